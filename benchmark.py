@@ -0,0 +1,78 @@
+from lib.struct.log import ColumnarLog, log_json_default
+from typing import Any, Callable, List
+import sys
+import time
+import tracemalloc
+
+
+def measure(build: Callable[[int], Any], entry_count: int) -> tuple[Any, int, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    log = build(entry_count)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return log, size, elapsed
+
+
+def entry(i: int) -> tuple[str, int]:
+    # Same shape as the log entries written by the leader, 1000 client sessions taking turns
+    return f'{i % 1000:032x}:{i // 1000 + 1}/enqueue("message number {i}")', i // 1000
+
+
+def build_lists(entry_count: int) -> tuple[List[str], List[int]]:
+    message_log, term_log = [], []
+    for i in range(entry_count):
+        message, term = entry(i)
+        message_log.append(message)
+        term_log.append(term)
+    return message_log, term_log
+
+
+def build_columnar(entry_count: int) -> ColumnarLog:
+    log = ColumnarLog()
+    for i in range(entry_count):
+        message, term = entry(i)
+        log.append(message, term)
+    return log
+
+
+def measure_slice(make_slice: Callable[[], Any]) -> tuple[int, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    sliced = make_slice()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sliced
+    return size, elapsed
+
+
+def main(entry_count: int):
+    print(f"Log with {entry_count} entries")
+    (message_log, term_log), list_size, list_time = measure(build_lists, entry_count)
+    print(f"  lists    : {list_size / 2**20:8.1f} MiB, {list_size / entry_count:6.1f} B/entry, built in {list_time:.2f}s")
+    columnar, columnar_size, columnar_time = measure(build_columnar, entry_count)
+    print(f"  columnar : {columnar_size / 2**20:8.1f} MiB, {columnar_size / entry_count:6.1f} B/entry, built in {columnar_time:.2f}s")
+    print(f"  ratio    : {list_size / columnar_size:.1f}x smaller")
+    # Per entry cost on top of the utf-8 payload itself, session prefixes included
+    payload = sum(len(message) for message in message_log)
+    print(f"  payload  : {payload / entry_count:.1f} B/entry as plain strings, columnar arena {len(columnar.arena) / entry_count:.1f} B/entry")
+
+    # Replication slices the second half of the log, as the troubled follower path does
+    half = entry_count // 2
+    size, elapsed = measure_slice(lambda: (message_log[half:], term_log[half:]))
+    print(f"Slice of {entry_count - half} entries")
+    print(f"  lists    : {size / 2**20:8.1f} MiB copied in {elapsed * 1000:.2f}ms")
+    size, elapsed = measure_slice(lambda: (columnar.messages[half:], columnar.term_view[half:]))
+    print(f"  columnar : {size:8d} B allocated in {elapsed * 1000:.2f}ms")
+
+    # Both still have to be materialized once for the JSON request
+    messages = columnar.messages[half:]
+    start = time.perf_counter()
+    assert log_json_default(messages) == message_log[half:]
+    print(f"  columnar serialization to list: {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -1,18 +1,25 @@
 from lib.struct.address       import Address
 from xmlrpc.client import ServerProxy
 from lib.app           import MessageQueue
+from lib.compression   import Compressor
 import sys
 import socket
 from typing import Any, List
 import json
 import time
+import uuid
 
 class Client:
     RPC_TIMEOUT = 2
+    RETRY_LIMIT = 3
+    POLL_INTERVAL = 1
 
     def __init__(self, addr: Address, server_addr: Address):
         self.addr: Address = addr
         self.server_addr: Address = server_addr
+        self.client_id: str = uuid.uuid4().hex
+        self.compressor: Compressor = Compressor()
+        self.seq: int = 0
 
     def change_server(self, addr: Address):
         self.server_addr = addr
@@ -35,7 +42,7 @@ class Client:
         }
         try:
             while response["status"] == "redirected":
-                response = json.loads(rpc_function(json_request))
+                response = json.loads(self.compressor.decode(rpc_function(json_request)))
                 print(response)
                 if response["status"] == "redirected":
                     addr = Address(response["address"]["ip"], response["address"]["port"])
@@ -52,6 +59,23 @@ class Client:
             print(response)
         return response
     
+    def __send_command(self, request: Any) -> "json":
+        # Every retry carries the same sequence number, the leader answers duplicates from its session table
+        self.seq += 1
+        request["session"] = {
+            "client_id": self.client_id,
+            "seq":       self.seq,
+        }
+        for _ in range(Client.RETRY_LIMIT):
+            response = self.__send_request(request, "execute", self.server_addr)
+            # A long-poll dequeue holds a message that has not committed yet, ask again until it does
+            while response["status"] == "pending":
+                time.sleep(Client.POLL_INTERVAL)
+                response = self.__send_request(request, "execute", self.server_addr)
+            if response["status"] != "failure":
+                break
+        return response
+
     #
     #   Client - Server RPC
     #
@@ -60,20 +84,59 @@ class Client:
             "method": "enqueue",
             "params": [message],
         }
-        response = self.__send_request(request, "execute", self.server_addr)
+        response = self.__send_command(request)
         return response
 
-    def dequeue(self) -> "json":
+    def dequeue(self, timeout: float = None) -> "json":
         request = {
             "method": "dequeue",
         }
-        response = self.__send_request(request, "execute", self.server_addr)
+        if timeout is not None:
+            request["timeout"] = timeout
+        response = self.__send_command(request)
+        return response
+
+    def request_log(self, start: int = 0, limit: int = 100) -> "json":
+        request = {
+            "start": start,
+            "limit": limit,
+            "compression": Compressor.ALGORITHM,
+        }
+        response = self.__send_request(request, "request_log", self.server_addr)
         return response
 
-    def request_log(self) -> "json":
-        response = self.__send_request(None, "request_log", self.server_addr)
+    def tail_log(self, start: int = 0, limit: int = 100) -> "json":
+        request = {
+            "start": start,
+            "limit": limit,
+            "compression": Compressor.ALGORITHM,
+        }
+        response = self.__send_request(request, "tail_log", self.server_addr)
         return response
     
+    def transfer_leadership(self, addr: Address) -> "json":
+        request = {
+            "address": {
+                "ip":   addr.ip,
+                "port": addr.port,
+            },
+        }
+        response = self.__send_request(request, "transfer_leadership", self.server_addr)
+        return response
+
+    def set_profile(self, enabled: bool, memory: bool = False, reset: bool = False) -> "json":
+        request = {
+            "enabled": enabled,
+            "memory":  memory,
+            "reset":   reset,
+        }
+        response = self.__send_request(request, "set_profile", self.server_addr)
+        return response
+
+    def get_profile(self) -> "json":
+        response = self.__send_request(None, "get_profile", self.server_addr)
+        return response
+
     def status(self) -> "json":
         request = {
             "method": "status",
@@ -104,14 +167,38 @@ if __name__ == "__main__":
 
             case c if c in ["dequeue", "deq"]:
                 # receive message
-                print("Dequeing message")
-                client.dequeue()
+                args = user_input.split(" ")
+                timeout = float(args[1]) if len(args) > 1 else None
+                print("Dequeing message" if timeout is None else f"Waiting up to {timeout}s for a message")
+                client.dequeue(timeout)
 
             case c if c in ["log", "request_log"]:
+                args = user_input.split(" ")[1:]
+                if len(args) > 0 and args[0] == "tail":
+                    start = int(args[1]) if len(args) > 1 else 0
+                    print("following committed log, press Ctrl+C to stop..")
+                    try:
+                        while True:
+                            response = client.tail_log(start)
+                            if response["status"] != "success":
+                                print("tail log failed")
+                                break
+                            if response["next"] > start:
+                                print(response["log"])
+                                start = response["next"]
+                            else:
+                                time.sleep(1)
+                    except KeyboardInterrupt:
+                        pass
+                    continue
                 print("requesting log..")
-                response = client.request_log()
+                start = int(args[0]) if len(args) > 0 else 0
+                limit = int(args[1]) if len(args) > 1 else 100
+                response = client.request_log(start, limit)
                 if response["status"] == "success":
                     print(response["log"])
+                    if response["next"] < response["total"]:
+                        print(f"showing {response['start']}-{response['next']} of {response['total']}, next page: log {response['next']} {limit}")
                 else:
                     print("request log failed")
 
@@ -123,14 +210,33 @@ if __name__ == "__main__":
                     temp_addr = Address(user_input.split(" ")[2], int(user_input.split(" ")[3]))
                     client.change_server(temp_addr)
                     print("Server node changed to", str(client))
+                elif user_input.split(" ")[1] == "profile":
+                    args = user_input.split(" ")[2:]
+                    if len(args) > 0 and args[0] in ["on", "off", "reset"]:
+                        client.set_profile(args[0] != "off", "memory" in args, args[0] == "reset")
+                    else:
+                        response = client.get_profile()
+                        if response["status"] == "success" and len(args) > 0:
+                            # Folded stacks, feed to flamegraph.pl or speedscope
+                            with open(args[0], "w") as f:
+                                f.write("\n".join(response["collapsed_stacks"]) + "\n")
+                            print("collapsed stacks written to", args[0])
+                elif user_input.split(" ")[1] == "transfer":
+                    temp_addr = Address(user_input.split(" ")[2], int(user_input.split(" ")[3]))
+                    print("Transferring leadership to", str(temp_addr))
+                    client.transfer_leadership(temp_addr)
                 else:
                     print("unknown command")
             case "help":
                 print('enqueue <message>        :           enqueue a message')
-                print('dequeue                  :           dequeue a message')
+                print('dequeue [timeout]        :           dequeue a message, wait up to timeout seconds for one')
                 print('node status              :           show current server node status')
                 print('node change <ip> <port>  :           change server node')
-                print('request_log              :           request log')
+                print('node transfer <ip> <port>:           hand leadership over to another node')
+                print('node profile on|off|reset:           toggle profiling, add "memory" for tracemalloc')
+                print('node profile [file]      :           show profile, optionally dump collapsed stacks')
+                print('request_log [start] [n]  :           request n log entries from start')
+                print('request_log tail [start] :           follow committed log entries')
                 print('exit                     :           exit the program')
             case _:
                 print("unknown command")
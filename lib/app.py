@@ -13,8 +13,13 @@ class MessageQueue:
         return {"status": self.Response.SUCCESS.value}
 
     def pop(self, _: any) -> str:
+        if len(self.queue) == 0:
+            return {"status": self.Response.FAILURE.value, "result": None}
         return {"status": self.Response.SUCCESS.value, "result": self.queue.pop(0)}
 
+    def size(self, _: any) -> int:
+        return {"status": self.Response.SUCCESS.value, "result": len(self.queue)}
+
     def is_empty(self) -> bool:
         return {"status": self.Response.SUCCESS.value, "result": len(self.queue) == 0}
 
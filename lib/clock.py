@@ -0,0 +1,102 @@
+from threading import Event, Thread
+from typing import Any, Coroutine
+import asyncio
+import random
+import selectors
+import time
+
+class SystemClock:
+    # Wall clock time, every node loop runs in its own thread
+    def __init__(self) -> None:
+        self.random = random.Random()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep_blocking(self, seconds: float):
+        time.sleep(seconds)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def wait_for(self, event: Event, timeout: float) -> bool:
+        return event.wait(timeout)
+
+    def spawn(self, coro: Coroutine) -> Any:
+        thread = Thread(target=asyncio.run, args=[coro])
+        thread.start()
+        return thread
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    # Instead of blocking on file descriptors, jump the virtual clock
+    # straight to the next scheduled timer
+    def __init__(self, clock: "VirtualClock") -> None:
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout: float = None):
+        if timeout is None:
+            raise RuntimeError("Virtual event loop has nothing scheduled")
+        if timeout > 0:
+            self.clock.now += timeout
+        return []
+
+
+class _VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: "VirtualClock") -> None:
+        self.clock = clock
+        super().__init__(_VirtualSelector(clock))
+
+    def time(self) -> float:
+        return self.clock.now
+
+
+class VirtualClock:
+    # Simulated time, every node loop runs as a task in one shared event loop
+    WAIT_POLL_INTERVAL = 0.05
+
+    def __init__(self, seed: int = None) -> None:
+        self.now:    float = 0.0
+        self.random: random.Random = random.Random(seed)
+        self.loop:   _VirtualEventLoop = _VirtualEventLoop(self)
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep_blocking(self, seconds: float):
+        # Outside the loop (simulated clients and node setup) the cluster keeps running meanwhile
+        if self.loop.is_running():
+            self.now += seconds
+        else:
+            self.run_for(seconds)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def wait_for(self, event: Event, timeout: float) -> bool:
+        # Callers outside the loop (simulated clients) drive the cluster while they wait
+        self.loop.run_until_complete(self.__wait_for(event, timeout))
+        return event.is_set()
+
+    async def __wait_for(self, event: Event, timeout: float):
+        deadline = self.now + timeout
+        while not event.is_set() and self.now < deadline:
+            await asyncio.sleep(min(VirtualClock.WAIT_POLL_INTERVAL, deadline - self.now))
+
+    def spawn(self, coro: Coroutine) -> Any:
+        return self.loop.create_task(coro)
+
+    def run_for(self, seconds: float):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def run_until(self, coro: Coroutine) -> Any:
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
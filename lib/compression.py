@@ -0,0 +1,67 @@
+from threading import Lock
+from typing import Any, Dict
+import base64
+import json
+import time
+import zlib
+
+class Compressor:
+    ALGORITHM = "zlib"
+    THRESHOLD = 4096
+    LEVEL_MIN = 0
+    LEVEL_MAX = 9
+    # Every compressed payload is a JSON envelope starting with this prefix
+    PREFIX = '{"compressed": "zlib", '
+
+    def __init__(self, level: int = 0, threshold: int = THRESHOLD) -> None:
+        # Level 0 disables compression of outgoing payloads, incoming ones are always understood
+        if not Compressor.LEVEL_MIN <= level <= Compressor.LEVEL_MAX:
+            raise ValueError(f"Compression level must be between {Compressor.LEVEL_MIN} and {Compressor.LEVEL_MAX}, got {level}")
+        self.level:     int = level
+        self.threshold: int = threshold
+        self.lock:      Lock = Lock()
+        self.stats:     Dict[str, float] = {
+            "compressed_count": 0,
+            "raw_bytes": 0,
+            "compressed_bytes": 0,
+            "compress_cpu": 0.0,
+            "decompressed_count": 0,
+            "decompress_cpu": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.level > 0
+
+    def encode(self, text: str) -> str:
+        if not self.enabled or len(text) < self.threshold:
+            return text
+        start = time.thread_time()
+        raw = text.encode()
+        data = zlib.compress(raw, self.level)
+        envelope = json.dumps({"compressed": Compressor.ALGORITHM, "data": base64.b64encode(data).decode()})
+        with self.lock:
+            self.stats["compressed_count"] += 1
+            self.stats["raw_bytes"] += len(raw)
+            self.stats["compressed_bytes"] += len(envelope)
+            self.stats["compress_cpu"] += time.thread_time() - start
+        return envelope
+
+    def decode(self, text: str) -> str:
+        if not isinstance(text, str) or not text.startswith(Compressor.PREFIX):
+            return text
+        start = time.thread_time()
+        envelope = json.loads(text)
+        decoded = zlib.decompress(base64.b64decode(envelope["data"])).decode()
+        with self.lock:
+            self.stats["decompressed_count"] += 1
+            self.stats["decompress_cpu"] += time.thread_time() - start
+        return decoded
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            report = dict(self.stats)
+        report["level"] = self.level
+        report["threshold"] = self.threshold
+        report["ratio"] = report["raw_bytes"] / report["compressed_bytes"] if report["compressed_bytes"] > 0 else 1.0
+        return report
@@ -0,0 +1,150 @@
+from collections import Counter
+from threading import Lock, Thread, get_ident
+from typing import Any, Callable, Dict, List
+import functools
+import os
+import sys
+import time
+import tracemalloc
+
+class Profiler:
+    SAMPLE_INTERVAL = 0.01
+    STACK_LIMIT = 200
+    MEMORY_LIMIT = 20
+
+    def __init__(self) -> None:
+        self.enabled:          bool = False
+        self.memory:           bool = False
+        self.owns_tracemalloc: bool = False
+        self.sample_interval:  float = Profiler.SAMPLE_INTERVAL
+        self.sections:         Dict[str, Dict[str, float]] = {}
+        self.stacks:           Counter = Counter()
+        self.sampler_thread:   Thread = None
+        self.lock:             Lock = Lock()
+        self.started_at:       float = time.time()
+
+    #
+    #   Toggling
+    #
+    def start(self, memory: bool = False, sample_interval: float = None):
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracemalloc = True
+        elif not memory:
+            self.__stop_memory()
+        self.memory = memory
+        self.enabled = True
+        if self.sample_interval > 0 and (self.sampler_thread is None or not self.sampler_thread.is_alive()):
+            self.sampler_thread = Thread(target=self.__sample, daemon=True)
+            self.sampler_thread.start()
+
+    def stop(self):
+        # The sampler thread notices on its next tick and exits
+        self.enabled = False
+        self.__stop_memory()
+        self.memory = False
+
+    def __stop_memory(self):
+        # Only a trace this profiler started is stopped, someone else may be tracing too
+        if self.owns_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.owns_tracemalloc = False
+
+    def reset(self):
+        with self.lock:
+            self.sections = {}
+            self.stacks = Counter()
+            self.started_at = time.time()
+
+    #
+    #   Tracing
+    #
+    def record(self, name: str, wall: float, cpu: float):
+        with self.lock:
+            section = self.sections.setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0})
+            section["count"] += 1
+            section["wall"] += wall
+            section["cpu"] += cpu
+            section["max_wall"] = max(section["max_wall"], wall)
+
+    def section(self, name: str) -> "_Section":
+        return _Section(self, name)
+
+    #
+    #   Sampling
+    #
+    def __sample(self):
+        own_id = get_ident()
+        while self.enabled:
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id != own_id:
+                        self.stacks[self.__collapse(frame)] += 1
+            time.sleep(self.sample_interval)
+
+    def __collapse(self, frame: Any) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    #
+    #   Reporting
+    #
+    def collapsed_stacks(self) -> List[str]:
+        # Folded format read by flamegraph.pl and speedscope, one "a;b;c count" per line
+        with self.lock:
+            return [f"{stack} {count}" for stack, count in self.stacks.most_common(Profiler.STACK_LIMIT)]
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            sections = {name: dict(section) for name, section in self.sections.items()}
+        report = {
+            "enabled": self.enabled,
+            "duration": time.time() - self.started_at,
+            "sections": sections,
+            "collapsed_stacks": self.collapsed_stacks(),
+        }
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:Profiler.MEMORY_LIMIT]
+            report["memory"] = {
+                "current": current,
+                "peak": peak,
+                "top": [{"location": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in statistics],
+            }
+        return report
+
+
+class _Section:
+    def __init__(self, profiler: Profiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *_):
+        if self.profiler.enabled:
+            self.profiler.record(self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+        return False
+
+
+def profiled(name: str) -> Callable:
+    # Method decorator, times the call through self.profiler while profiling is on
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if not self.profiler.enabled:
+                return function(self, *args, **kwargs)
+            with self.profiler.section(name):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,13 +1,17 @@
 import asyncio
-from threading import Thread
-from xmlrpc.client import ServerProxy
+from collections import OrderedDict, deque
+from threading import Event, Lock, RLock
 from typing import Any, List, Dict
 from enum import Enum
 from lib.struct.address import Address
+from lib.struct.log import ColumnarLog, MessageView, TermView, log_json_default
+from lib.transport import XMLRPCTransport
+from lib.clock import SystemClock
+from lib.profiler import Profiler, profiled
+from lib.compression import Compressor
 import json
 import socket
 import time
-import random
 
 class bcolors:
     HEADER = '\033[95m'
@@ -25,6 +29,11 @@ class RaftNode:
     ELECTION_TIMEOUT_MIN = 40
     ELECTION_TIMEOUT_MAX = 80    
     RPC_TIMEOUT = 5
+    TRANSFER_ATTEMPTS = 5
+    LOG_PAGE_SIZE = 100
+    LOG_PAGE_MAX = 1000
+    SESSION_LIMIT = 1024
+    SESSION_WINDOW = 16
 
     class AppResponse(Enum):
         SUCCESS = 1
@@ -35,17 +44,28 @@ class RaftNode:
         CANDIDATE = 2
         FOLLOWER = 3
 
-    def __init__(self, application: Any, addr: Address, contact_addr: Address = None, passive: bool = False):
+    def __init__(self, application: Any, addr: Address, contact_addr: Address = None, passive: bool = False,
+                 transport: Any = None, clock: Any = None, verbose: bool = True, profile: bool = False,
+                 compression_level: int = 0):
         socket.setdefaulttimeout(RaftNode.RPC_TIMEOUT)
+        self.transport:                 Any = transport if transport is not None else XMLRPCTransport()
+        self.clock:                     Any = clock if clock is not None else SystemClock()
+        self.verbose:                   bool = verbose
+        self.profiler:                  Profiler = Profiler()
+        self.compressor:                Compressor = Compressor(compression_level)
         self.app:                       Any = application
         self.address:                   Address = addr
         self.type:                      RaftNode.NodeType = None
-        self.message_log:               List[str] = []
-        self.term_log:                  List[int] = []    
+        self.log:                       ColumnarLog = ColumnarLog()
+        self.message_log:               MessageView = self.log.messages
+        self.term_log:                  TermView = self.log.term_view
         self.commit_index_log:          List[int] = []
         self.committed_length:          int = 0
         self.election_term:             int = 0
         self.cluster_addr_list:         List[Address] = []
+        self.config_version:            List[int] = [0, 0]
+        self.follower_config_versions:  Dict[str, List[int]] = {}
+        self.follower_compression:      Dict[str, bool] = {}
         self.troubled_clusters:         Dict[str, Dict[str, Any]] = {}
         self.cluster_leader_addr:       Address = None
         self.heartbeat_timer:           int = 0
@@ -54,6 +74,14 @@ class RaftNode:
         self.accepted_addr_list:        List[int] = []
         self.current_timeout:           int = 0
         self.commit_index:              int = 0
+        self.log_lock:                  RLock = RLock()
+        self.consumer_lock:             Lock = Lock()
+        self.waiting_consumers:         deque[Dict[str, Any]] = deque()
+        self.claimed_consumers:         Dict[int, Dict[str, Any]] = {}
+        self.sessions:                  OrderedDict[str, tuple[int, Dict[int, Dict[str, Any]]]] = OrderedDict()
+        self.transport.bind(self)
+        if profile:
+            self.profiler.start()
         if passive:
             self.type = RaftNode.NodeType.FOLLOWER
             self.__print_log("Waiting for another node to contact...")
@@ -69,9 +97,11 @@ class RaftNode:
     #   Internal Raft Node methods
     #
     def __get_random_timeout(self) -> int:
-        return random.randint(RaftNode.ELECTION_TIMEOUT_MIN, RaftNode.ELECTION_TIMEOUT_MAX)
+        return self.clock.random.randint(RaftNode.ELECTION_TIMEOUT_MIN, RaftNode.ELECTION_TIMEOUT_MAX)
 
     def __print_log(self, text: str):
+        if not self.verbose:
+            return
         if self.type == RaftNode.NodeType.LEADER:
             print(f"{bcolors.OKGREEN}[{self.election_term}] [{self.address}] [{time.strftime('%H:%M:%S')}]{bcolors.ENDC} {text}")
         elif self.type == RaftNode.NodeType.CANDIDATE:
@@ -83,8 +113,10 @@ class RaftNode:
         self.__print_log("Initialize as leader node...")
         self.cluster_leader_addr = self.address
         self.type = RaftNode.NodeType.LEADER
+        self.follower_config_versions = {}
         request = {
             "cluster_addr_list": self.cluster_addr_list,
+            "config_version":    self.config_version,
             "cluster_leader_addr": self.address,
             "election_term":       self.election_term,
             "message_log":          self.message_log,
@@ -98,9 +130,7 @@ class RaftNode:
                 self.__send_request(request, "heartbeat", addr)
 
         # self.heartbeat_thread.stop()
-        self.heartbeat_thread = Thread(target=asyncio.run, args=[
-                                       self.__leader_heartbeat()])
-        self.heartbeat_thread.start()
+        self.heartbeat_thread = self.clock.spawn(self.__leader_heartbeat())
 
     # async def __hearbeat_to_follower(self, follower_addr: Address, request: Dict[str, Any]):
     #     self.__print_log(f"[Leader] Sending heartbeat to {follower_addr}")
@@ -108,82 +138,127 @@ class RaftNode:
 
     async def __leader_heartbeat(self):
         while self.type == RaftNode.NodeType.LEADER:
-            self.__print_log("[Leader] Sending heartbeat...")
+            with self.profiler.section("leader_heartbeat"):
+                await self.__leader_heartbeat_round()
+            await self.clock.sleep(RaftNode.HEARTBEAT_INTERVAL)
+
+    async def __leader_heartbeat_round(self):
+        self.__print_log("[Leader] Sending heartbeat...")
+        if self.verbose:
             self.__print_log(self.__log_repr())
-            tasks = []
-            for addr in self.cluster_addr_list:
-                if addr != self.address:
-                    request = {
-                        "cluster_addr_list": self.cluster_addr_list,
-                        "method": "sync",
-                        "curr_term": self.election_term,
-                        "prefix_len": len(self.message_log) - len(self.commit_index_log) if len(self.message_log) > 0 else 0,
-                        "last_term": self.term_log[len(self.message_log) - len(self.commit_index_log) - 1] if len(self.message_log) > 0 else self.election_term,
-                        "messages": self.message_log[-(len(self.commit_index_log)):] if len(self.commit_index_log) > 0 else [],
-                        "last_message": self.message_log[len(self.message_log) - len(self.commit_index_log) - 1] if len(self.message_log) > 0 else "",
-                        "terms": self.term_log[-len(self.commit_index_log):] if len(self.commit_index_log ) > 0 else [],
-                        "leader_commit": self.committed_length,
-                        "cluster_leader_addr": {
-                            "ip":   self.address.ip,
-                            "port": self.address.port,
-                        },
-                        "election_term": self.election_term,
-                    }
+        tasks = []
+        task_addrs = []
+        requests = []
+        with self.log_lock:
+            carried_length = self.__build_heartbeats(requests)
+        for addr, request in requests:
+            compress = self.follower_compression.get(str(addr), False)
+            tasks.append(asyncio.create_task(self.__send_heartbeat(request, "heartbeat", addr, compress)))
+            task_addrs.append(addr)
 
-                    if str(addr) in self.troubled_clusters.keys():
-                        response = self.troubled_clusters[str(addr)]
-                        # When follower is zeroed (ex: cold restart)
-                        if response["message_len"] == 0 and len(self.message_log) != 0:
-                            request["prefix_len"] = 0
-                            request["messages"] = self.message_log
-                            request["terms"] = self.term_log
-                        
-                        # When follower is delayed (ex: network delay)
-                        else:
-                            for idx in range(len(self.message_log) - 1, -1, -1):
-                                if self.message_log[idx] == response["last_message"] and self.term_log[idx] == response["last_term"]:
-                                    # set the prefix_len, last_term, messages, last_message, terms
-                                    request["prefix_len"] = len(self.message_log) - idx
-                                    request["last_term"] = self.term_log[idx]
-                                    request["last_message"] = self.message_log[idx]
-                                    request["messages"] = self.message_log[idx:]
-                                    request["terms"] = self.term_log[idx:]
-                                    break
-                            # Last message not found, send all messages
-                            request["prefix_len"] = 0
-                            request["messages"] = self.message_log
-                            request["terms"] = self.term_log
+        responses = await asyncio.gather(*tasks)
 
-                    # Add to tasks list
-                    tasks.append(asyncio.create_task(self.__send_heartbeat(request, "heartbeat", addr)))
+        completed = []
+        with self.log_lock:
+            for addr, response in zip(task_addrs, responses):
+                # A newer term exists somewhere (ex: this node was partitioned away), step down
+                if response["status"] == "failure" and response.get("election_term", -1) > self.election_term:
+                    self.__print_log(f"Found newer term {response['election_term']} at {addr}, stepping down")
+                    self.election_term = response["election_term"]
+                    # The node that knows the newer term redirects on to its leader
+                    self.cluster_leader_addr = addr
+                    self.__initialize_as_follower()
+                    return
 
-            responses = await asyncio.gather(*tasks)
+                if "config_version" in response.keys():
+                    self.follower_config_versions[str(addr)] = response["config_version"]
+                if "compression" in response.keys():
+                    self.follower_compression[str(addr)] = response["compression"] == Compressor.ALGORITHM
 
-            for response in responses:
                 # Troubled cluster, no more
-                if ("ack" in response.keys() and response["ack"] == True) and ("addr" in response.keys() and response["addr"] in self.troubled_clusters.keys()):
-                    self.troubled_clusters.pop(response["addr"])
+                if ("ack" in response.keys() and response["ack"] == True) and str(addr) in self.troubled_clusters.keys():
+                    self.troubled_clusters.pop(str(addr))
 
                 # Follower acked the message, increment commit index
-                if self.commit_index_log.__len__() > 0 and ("ack" in response.keys() and response["ack"] == True):
+                if self.commit_index_log.__len__() > 0 and carried_length == len(self.commit_index_log) and ("ack" in response.keys() and response["ack"] == True):
                     self.commit_index_log[-1] += 1
 
                 # Troubled cluster, offer help (call 911)
                 if ("ack" in response.keys() and response["ack"] == False) and ("status" in response.keys() and response["status"] != "failure"):
-                    self.troubled_clusters[str(response["addr"])] = response
+                    self.troubled_clusters[str(addr)] = response
 
 
             if self.commit_index_log.__len__() > 0 and (self.commit_index_log[-1] >= (len(self.cluster_addr_list) // 2) + 1):
                 for i in range(self.committed_length, self.committed_length + len(self.commit_index_log)):
                         if i > len(self.message_log) - 1:
                             break
-                        method = self.message_log[i].split("(")[0]
-                        parameter = self.message_log[i].split("(")[1].split(")")[0].replace('"', "")
-                        self.__app_execute(method, parameter)
+                        completed.append((i, self.__apply_entry(i)))
                 self.committed_length += len(self.commit_index_log)
                 self.commit_index_log = []
-                
-            await asyncio.sleep(RaftNode.HEARTBEAT_INTERVAL)
+
+        # Consumers are woken outside log_lock, __hand_off takes consumer_lock before log_lock
+        if completed:
+            for i, result in completed:
+                self.__complete_consumer(i, result)
+            with self.consumer_lock:
+                self.__hand_off()
+
+    def __build_heartbeats(self, requests: List[tuple[Address, Dict[str, Any]]]) -> int:
+        # Caller must hold log_lock, returns how many uncommitted entries the round carries
+        # Built once per round, followers that are up to date all share it
+        keep_alive = {
+            "method": "sync",
+            "curr_term": self.election_term,
+            "prefix_len": len(self.message_log) - len(self.commit_index_log) if len(self.message_log) > 0 else 0,
+            "last_term": self.log.term(len(self.log) - len(self.commit_index_log) - 1) if len(self.log) > 0 else self.election_term,
+            "leader_commit": self.committed_length,
+            "cluster_leader_addr": {
+                "ip":   self.address.ip,
+                "port": self.address.port,
+            },
+            "election_term": self.election_term,
+            "config_version": self.config_version,
+        }
+        # Acks only count for the entries this round actually carried
+        carried_length = len(self.commit_index_log)
+        if len(self.commit_index_log) > 0:
+            keep_alive["messages"] = self.message_log[-(len(self.commit_index_log)):]
+            keep_alive["terms"] = self.term_log[-len(self.commit_index_log):]
+
+        for addr in self.cluster_addr_list:
+            if addr != self.address:
+                request = keep_alive
+                if self.follower_config_versions.get(str(addr)) != self.config_version:
+                    request = dict(keep_alive)
+                    request["cluster_addr_list"] = self.cluster_addr_list
+
+                if str(addr) in self.troubled_clusters.keys():
+                    request = dict(request)
+                    response = self.troubled_clusters[str(addr)]
+                    # When follower is zeroed (ex: cold restart)
+                    if response["message_len"] == 0 and len(self.message_log) != 0:
+                        request["prefix_len"] = 0
+                        request["messages"] = self.message_log[:]
+                        request["terms"] = self.term_log[:]
+                    
+                    # When follower is delayed (ex: network delay)
+                    else:
+                        # Its last entry sits at index message_len - 1, if the term there matches
+                        # everything before it matches too and only the suffix after it is missing
+                        idx = response["message_len"] - 1
+                        if idx < len(self.log) and self.log.term(idx) == response["last_term"] and self.log.message(idx) == response["last_message"]:
+                            request["prefix_len"] = idx + 1
+                            request["last_term"] = self.log.term(idx)
+                            request["messages"] = self.message_log[idx + 1:]
+                            request["terms"] = self.term_log[idx + 1:]
+                        # Last message not found, send all messages
+                        else:
+                            request["prefix_len"] = 0
+                            request["messages"] = self.message_log[:]
+                            request["terms"] = self.term_log[:]
+
+                requests.append((addr, request))
+        return carried_length
 
     def __try_to_apply_membership(self, contact_addr: Address):
         redirected_addr = contact_addr
@@ -200,25 +275,27 @@ class RaftNode:
                 "port": self.address.port,
             },
         }
+        if self.compressor.enabled:
+            request["compression"] = Compressor.ALGORITHM
         while response["status"] != "success":
             redirected_addr = Address(
                 response["address"]["ip"], response["address"]["port"])
             response = self.__send_request(
                 request, "apply_membership", redirected_addr)
-            time.sleep(self.RPC_TIMEOUT)
-        self.message_log = response["message_log"]
-        self.term_log = response["term_log"]
+            if response["status"] == "failure":
+                self.clock.sleep_blocking(self.RPC_TIMEOUT)
+        self.log.clear()
+        self.log.extend(response["message_log"], response["term_log"])
         self.committed_length = response["leader_commit"]
         self.election_term = response["election_term"]
         self.cluster_addr_list = list(map(lambda addr: Address(addr["ip"], addr["port"]), response["cluster_addr_list"]))
+        self.config_version = response["config_version"]
         self.cluster_leader_addr = redirected_addr
 
     def __initialize_as_follower(self):
         self.__print_log("Initialize as follower node...")
         self.type = RaftNode.NodeType.FOLLOWER
-        self.heartbeat_thread = Thread(target=asyncio.run, args=[
-                                    self.__follower_heartbeat()])
-        self.heartbeat_thread.start()
+        self.heartbeat_thread = self.clock.spawn(self.__follower_heartbeat())
 
     async def __follower_heartbeat(self):
         self.heartbeat_timer = 0
@@ -226,37 +303,78 @@ class RaftNode:
         current_term = self.election_term
         while self.type == RaftNode.NodeType.FOLLOWER and current_term == self.election_term:
             self.heartbeat_timer += 1
-            print(bcolors.OKBLUE, "Timer:", self.heartbeat_timer, bcolors.ENDC)
+            if self.verbose:
+                print(bcolors.OKBLUE, "Timer:", self.heartbeat_timer, bcolors.ENDC)
             if self.heartbeat_timer >= self.current_timeout:
                 self.__print_log("Election timeout")
                 self.__initialize_as_candidate()
                 return
-            await asyncio.sleep(1)
+            await self.clock.sleep(1)
 
-    def __initialize_as_candidate(self):
+    def __initialize_as_candidate(self, skip_pre_vote: bool = False):
         self.__print_log("Initialize as candidate node...")
         self.type = RaftNode.NodeType.CANDIDATE
         # self.heartbeat_thread.stop()
-        self.heartbeat_thread = Thread(target=asyncio.run, args=[
-                                        self.__candidate_heartbeat()])
-        self.heartbeat_thread.start()
+        self.heartbeat_thread = self.clock.spawn(self.__candidate_heartbeat(skip_pre_vote))
 
 
-    async def __candidate_heartbeat(self):
+    async def __candidate_heartbeat(self, skip_pre_vote: bool = False):
+        # Only bump the term once a majority would vote, a node cut off from the
+        # cluster would otherwise come back with an inflated term and depose the leader
+        if not skip_pre_vote and not await self.__send_pre_vote_request():
+            self.__print_log("Pre-vote rejected, staying at current term")
+            if self.type == RaftNode.NodeType.CANDIDATE:
+                self.__initialize_as_follower()
+            return
+
         while self.type == RaftNode.NodeType.CANDIDATE:
             self.heartbeat_timer = 0
             self.current_timeout = self.__get_random_timeout()
             self.election_term += 1
             self.voted_for = (self.election_term, self.address)
             self.vote_count = 1
-            prev_time = time.time()
+            self.accepted_addr_list = []
+            prev_time = self.clock.time()
             while self.heartbeat_timer < self.current_timeout and self.type == RaftNode.NodeType.CANDIDATE:
-                print(bcolors.OKBLUE, "Timer:", self.heartbeat_timer, bcolors.ENDC)
+                if self.verbose:
+                    print(bcolors.OKBLUE, "Timer:", self.heartbeat_timer, bcolors.ENDC)
                 await self.__send_vote_request()
-                curr_time = time.time()
+                curr_time = self.clock.time()
                 self.heartbeat_timer += curr_time - prev_time
                 prev_time = curr_time
-                await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+                await self.clock.sleep(self.HEARTBEAT_INTERVAL)
+
+    async def __request_quorum(self, request: Dict[str, Any], rpc_name: str, accepted_addr_list: List[Address]) -> bool:
+        # Returns as soon as a majority (counting this node) granted, without waiting for slow peers
+        majority = len(self.cluster_addr_list) // 2 + 1
+        tasks = []
+        for addr in self.cluster_addr_list:
+            if addr != self.address:
+                tasks.append(asyncio.create_task(self.__send_heartbeat(request, rpc_name, addr)))
+        pending = set(tasks)
+        while pending and len(accepted_addr_list) + 1 < majority:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                response = task.result()
+                if response["status"] == "success" and "address" in response.keys():
+                    resp_addr = Address(response["address"]["ip"], response["address"]["port"])
+                    if resp_addr not in accepted_addr_list:
+                        accepted_addr_list.append(resp_addr)
+        for task in pending:
+            task.cancel()
+        return len(accepted_addr_list) + 1 >= majority
+
+    async def __send_pre_vote_request(self) -> bool:
+        request = {
+            "election_term": self.election_term + 1,
+            "candidate_addr": {
+                "ip":   self.address.ip,
+                "port": self.address.port,
+            },
+            "last_term": self.term_log[-1] if len(self.term_log) > 0 else 0,
+            "log_length": len(self.message_log),
+        }
+        return await self.__request_quorum(request, "handle_pre_vote_request", [])
 
     async def __send_vote_request(self):
         request = {
@@ -267,18 +385,9 @@ class RaftNode:
             },
             "commit_index": self.commit_index,
         }
-        tasks = []
-        self.accepted_addr_list = []
-        for addr in self.cluster_addr_list:
-            if addr != self.address:
-                tasks.append(asyncio.create_task(self.__send_heartbeat(request, "handle_vote_request", addr)))
-        responses = await asyncio.gather(*tasks)
-        for response in responses:
-            resp_addr = Address(response["address"]["ip"], response["address"]["port"])
-            if response["status"] == "success" and resp_addr not in self.accepted_addr_list :
-                self.accepted_addr_list.append(resp_addr)
-                self.vote_count += 1
-        if self.vote_count > len(self.cluster_addr_list) / 2 and self.type == RaftNode.NodeType.CANDIDATE:
+        won = await self.__request_quorum(request, "handle_vote_request", self.accepted_addr_list)
+        self.vote_count = len(self.accepted_addr_list) + 1
+        if won and self.type == RaftNode.NodeType.CANDIDATE:
             self.__initialize_as_leader()
  
     
@@ -286,13 +395,164 @@ class RaftNode:
         self.cluster_leader_addr = Address(request["cluster_leader_addr"]["ip"], request["cluster_leader_addr"]["port"])
         self.election_term = request["election_term"]
         self.voted_for = (self.election_term, self.cluster_leader_addr)
-        self.commit_index = request["commit_index"]
+        # Keep-alives do not carry commit_index, only the sync sent by a new leader does
+        self.commit_index = request.get("commit_index", self.commit_index)
         self.__initialize_as_follower()
+
+    def __redirect_response(self) -> Dict[str, Any]:
+        # Without a known leader (ex: passive node) the caller retries this node later
+        if self.cluster_leader_addr is None:
+            return {
+                "status": "failure",
+                "message": "No known leader",
+                "address": {
+                    "ip":   self.address.ip,
+                    "port": self.address.port,
+                }
+            }
+        return {
+            "status": "redirected",
+            "address": {
+                "ip":   self.cluster_leader_addr.ip,
+                "port": self.cluster_leader_addr.port,
+            }
+        }
         
     def __app_execute(self, method: str, params: Any):
         function = getattr(self.app, "push" if method == "enqueue" else "pop" if method == "dequeue" else None)
         return function(params)
 
+    #
+    #   Client sessions
+    #
+    def __session_prefix(self, request: Dict[str, Any]) -> str:
+        # Log entries of a session look like <client_id>:<seq>/enqueue("message")
+        if "session" not in request:
+            return ""
+        client_id = str(request["session"]["client_id"]).replace("/", "").replace("(", "")
+        return f"{client_id}:{int(request['session']['seq'])}/"
+
+    def __parse_entry(self, message: str) -> tuple[str, int, str, str]:
+        head, body = message.split("(", 1)
+        client_id, seq = None, None
+        if "/" in head:
+            session, head = head.split("/", 1)
+            client_id, seq = session.rsplit(":", 1)
+            seq = int(seq)
+        parameter = body.split(")")[0].replace('"', "")
+        return client_id, seq, head, parameter
+
+    @profiled("apply")
+    def __apply_entry(self, index: int) -> Dict[str, Any]:
+        client_id, seq, method, parameter = self.__parse_entry(self.log.message(index))
+        if client_id is None:
+            return self.__app_execute(method, parameter)
+
+        # Retried request, answer from the session table instead of applying twice.
+        # Results are kept per seq so an entry overtaken by a later seq is still applied,
+        # only seqs that fell out of the window sit at or below the low-water mark
+        low_water, results = self.sessions.get(client_id, (0, {}))
+        if seq in results:
+            return results[seq]
+        if seq <= low_water:
+            return {"status": RaftNode.AppResponse.FAILURE.value, "result": None}
+
+        result = self.__app_execute(method, parameter)
+        results[seq] = result
+        while len(results) > RaftNode.SESSION_WINDOW:
+            low_water = min(results)
+            results.pop(low_water)
+        self.sessions[client_id] = (low_water, results)
+        self.sessions.move_to_end(client_id)
+        while len(self.sessions) > RaftNode.SESSION_LIMIT:
+            self.sessions.popitem(last=False)
+        return result
+
+    def __session_response(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # Response for a request that was already applied, is still waiting to commit or arrived out of order
+        prefix = self.__session_prefix(request)
+        if prefix == "":
+            return None
+        client_id, seq = prefix[:-1].rsplit(":", 1)
+        seq = int(seq)
+        low_water, results = self.sessions.get(client_id, (0, {}))
+        if seq in results:
+            response = {"status": "success", "ack": True, "duplicate": True}
+            result = results[seq]
+            if result["status"] == RaftNode.AppResponse.SUCCESS.value and result.get("result") is not None:
+                response["result"] = result["result"]
+            return response
+
+        pending_seqs = []
+        for index in range(self.committed_length, len(self.log)):
+            entry_client_id, entry_seq = self.log.session(index)
+            if entry_client_id == client_id:
+                pending_seqs.append(entry_seq)
+        if seq in pending_seqs:
+            # A long-poll dequeue re-polling for a message it already claimed
+            if request["method"] == "dequeue" and "timeout" in request:
+                return {"status": "pending", "ack": True}
+            return {"status": "success", "ack": True, "duplicate": True}
+
+        # Pipelined or hedged requests may arrive out of order, a seq overtaken by later ones is
+        # still accepted while it stays inside the window. Older ones would be dropped when applied,
+        # so they are refused before they are acked
+        last_seq = max([low_water, *results, *pending_seqs])
+        if seq <= low_water or seq <= last_seq - RaftNode.SESSION_WINDOW:
+            return {"status": "rejected", "ack": False, "last_seq": last_seq}
+        return None
+
+    #
+    #   Long-poll dequeue
+    #
+    def __available_messages(self) -> int:
+        # Committed messages not yet claimed by an uncommitted dequeue
+        pending_dequeues = sum(1 for index in range(self.committed_length, len(self.log)) if self.log.message(index).endswith("dequeue()"))
+        return self.app.size(None)["result"] - pending_dequeues
+
+    def __hand_off(self):
+        # Caller must hold consumer_lock, consumers are served in arrival order
+        with self.log_lock:
+            available = self.__available_messages()
+            while self.waiting_consumers and available > 0:
+                consumer = self.waiting_consumers.popleft()
+                index = len(self.message_log)
+                self.__push([consumer["session"] + "dequeue()"], [self.election_term], index)
+                self.commit_index_log.append(1)
+                consumer["claimed"] = True
+                self.claimed_consumers[index] = consumer
+                available -= 1
+
+    def __complete_consumer(self, index: int, result: Dict[str, Any]):
+        with self.consumer_lock:
+            consumer = self.claimed_consumers.pop(index, None)
+        if consumer is None:
+            return
+        if result["status"] == RaftNode.AppResponse.SUCCESS.value:
+            consumer["response"] = {"status": "success", "ack": True, "result": result["result"]}
+        consumer["event"].set()
+
+    def __wait_dequeue(self, timeout: float, session: str) -> Dict[str, Any]:
+        consumer = {
+            "session":  session,
+            "event":    Event(),
+            "claimed":  False,
+            "response": {"status": "failure", "ack": False},
+        }
+        with self.consumer_lock:
+            self.waiting_consumers.append(consumer)
+            self.__hand_off()
+        if not self.clock.wait_for(consumer["event"], timeout):
+            with self.consumer_lock:
+                if not consumer["claimed"]:
+                    self.waiting_consumers.remove(consumer)
+                    return {"status": "timeout", "ack": False}
+            # A message is already reserved, wait for its dequeue to commit.
+            # It still commits later, so the client re-polls with the same session instead of failing
+            if not self.clock.wait_for(consumer["event"], RaftNode.HEARTBEAT_INTERVAL * 2):
+                return {"status": "pending", "ack": True}
+        return consumer["response"]
+
     #
     # External Log methods
     #
@@ -300,13 +560,18 @@ class RaftNode:
     def app_execute(self, json_request: json) -> "json":
         # print("Type??", type(json_request), "at", str(self.address))
         request = json.loads(json_request)
+        with self.log_lock:
+            return self.__app_execute_locked(request)
+
+    def __app_execute_locked(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # Caller must hold log_lock, appends read the log length as their prefix
         match request["method"]:
             case inp if inp in ["enqueue", "dequeue"]:
                 try:
                     if request["method"] == "enqueue":
-                        log_msg = 'enqueue("' + request["params"][0] + '")'
+                        log_msg = self.__session_prefix(request) + 'enqueue("' + request["params"][0] + '")'
                     else:
-                        log_msg = "dequeue()"
+                        log_msg = self.__session_prefix(request) + "dequeue()"
                     self.__push([log_msg], [self.election_term], self.message_log.__len__())
                     return {"status" : "success", "ack": True}
                 except:
@@ -318,14 +583,12 @@ class RaftNode:
                         self.election_term = request["curr_term"]
                     if request["curr_term"] == self.election_term:
                         self.type = self.NodeType.FOLLOWER
-                    logOk: bool = (self.message_log.__len__() >= request["prefix_len"]) and (request["prefix_len"] == 0 or self.term_log[request["prefix_len"] - 1] == request["last_term"])
+                    logOk: bool = (len(self.log) >= request["prefix_len"]) and (request["prefix_len"] == 0 or self.log.term(request["prefix_len"] - 1) == request["last_term"])
                     if self.election_term == request["curr_term"] and logOk:
-                        self.__push(request["messages"], request["terms"], int(request["prefix_len"]))
+                        self.__push(request.get("messages", []), request.get("terms", []), int(request["prefix_len"]))
                         if request["leader_commit"] > self.committed_length:
                             for i in range(self.committed_length, request["leader_commit"]):
-                                method = self.message_log[i].split("(")[0]
-                                parameter = self.message_log[i].split("(")[1].split(")")[0].replace('"', "")
-                                self.__app_execute(method, parameter)
+                                self.__apply_entry(i)
                             self.committed_length = request["leader_commit"]
                         return {"status" : "success", "ack": True}
                     return {
@@ -349,29 +612,29 @@ class RaftNode:
     #
     #   Internal Log Methods
     #
-    def __get_log(self) -> List[str]:
+    def __get_log(self) -> MessageView:
         return self.message_log
     
+    @profiled("push")
     def __push(self, messages: List[str], terms: List[int], prefix_len: int):
-        if (len(messages) == 0) and prefix_len == len(self.message_log):
+        # Entries already held with the same term are kept, only the first conflict onwards is replaced
+        matched = 0
+        while matched < len(messages) and prefix_len + matched < len(self.log) and self.log.term(prefix_len + matched) == terms[matched]:
+            matched += 1
+        if matched > 0:
+            messages, terms, prefix_len = messages[matched:], terms[matched:], prefix_len + matched
+
+        if (len(messages) == 0) and prefix_len == len(self.log):
             return
 
-        while prefix_len < self.message_log.__len__():
-            self.committed_length -= 1 if self.committed_length > 0 else 0
-            self.term_log.pop(0)
-            self.message_log.pop(0)
-
-        for i in range(len(messages)):
-            self.message_log.append(messages[i])
-            self.term_log.append(terms[i])
-
-    def __pop(self) -> str:
-        if (self.committed_length == 0):
-            return "err: you dum dum theres nothing on the list!" # yg ganti ini juga dum dum diam kamu
-        self.committed_length -= 1
-        self.term_log.pop(0)
-        return self.message_log.pop(0)
+        # Entries after the prefix conflict with the leader, drop them
+        if prefix_len < len(self.log):
+            self.committed_length = min(self.committed_length, prefix_len)
+            self.log.truncate(prefix_len)
+
+        self.log.extend(messages, terms)
     
+    @profiled("log_repr")
     def __log_repr(self) -> str:
         repr_output = "Representation: \n"
         repr_output += "Term log    : " + str(self.term_log) + "\n"
@@ -387,11 +650,16 @@ class RaftNode:
     #
     #   RPC methods
     #
+    def __encode_response(self, request: Dict[str, Any], response: Dict[str, Any]) -> str:
+        # Only compress for callers that asked for it
+        json_response = json.dumps(response, default=log_json_default)
+        if request and request.get("compression") == Compressor.ALGORITHM:
+            return self.compressor.encode(json_response)
+        return json_response
+
     def __send_request(self, request: Any, rpc_name: str, addr: Address) -> "json":
         # Warning : This method is blocking
-        node = ServerProxy(f"http://{addr.ip}:{addr.port}")
-        json_request = json.dumps(request)
-        rpc_function = getattr(node, rpc_name)
+        json_request = json.dumps(request, default=log_json_default)
         response = {
             "status": "failure",
             "address": {
@@ -400,7 +668,8 @@ class RaftNode:
             }
         } 
         try:
-            response = json.loads(rpc_function(json_request))
+            with self.profiler.section(f"send:{rpc_name}"):
+                response = json.loads(self.compressor.decode(self.transport.call(addr, rpc_name, json_request)))
         except (ConnectionRefusedError, ConnectionResetError, ConnectionError, ConnectionAbortedError):
             self.__print_log(f"[{rpc_name}] Connection error")
             response = {
@@ -430,15 +699,17 @@ class RaftNode:
                     "port": addr.port,
                 }
             } 
-        print(f"{bcolors.OKBLUE} [<- {addr} ] {response} {bcolors.ENDC}")
+        if self.verbose:
+            print(f"{bcolors.OKBLUE} [<- {addr} ] {response} {bcolors.ENDC}")
         return response
     
-    async def __send_heartbeat(self, request: Any, rpc_name: str, addr: Address) -> "json":
-        node = ServerProxy(f"http://{addr.ip}:{addr.port}")
-        json_request = json.dumps(request)
-        rpc_function = getattr(node, rpc_name)
+    async def __send_heartbeat(self, request: Any, rpc_name: str, addr: Address, compress: bool = False) -> "json":
         try:
-            response = json.loads(rpc_function(json_request))
+            json_request = json.dumps(request, default=log_json_default)
+            if compress:
+                json_request = self.compressor.encode(json_request)
+            with self.profiler.section(f"send:{rpc_name}"):
+                response = json.loads(self.compressor.decode(await self.transport.async_call(addr, rpc_name, json_request)))
         except (ConnectionRefusedError, ConnectionResetError, ConnectionError, ConnectionAbortedError):
             self.__print_log(f"[{rpc_name}] Heartbeat Connection error")
             response = {
@@ -469,18 +740,27 @@ class RaftNode:
                 }
             } 
         # self.__print_log(response)
-        print(f"{bcolors.OKBLUE} [<- {addr} ] {response} {bcolors.ENDC}")
+        if self.verbose:
+            print(f"{bcolors.OKBLUE} [<- {addr} ] {response} {bcolors.ENDC}")
         return response
 
     #
     # Inter-node RPCs
     #
+    @profiled("heartbeat")
     def heartbeat(self, json_request: str) -> "json":
+        json_request = self.compressor.decode(json_request)
         request = json.loads(json_request)
+        was_candidate = self.type == RaftNode.NodeType.CANDIDATE
+        was_leader = self.type == RaftNode.NodeType.LEADER
+        term_before = self.election_term
 
         # Process the request if the term >= current term
         if request["election_term"] >= self.election_term:
-            self.cluster_addr_list = list(map(lambda addr: Address(addr["ip"], addr["port"]), request["cluster_addr_list"]))
+            # Membership is only sent when it changed since the version this node acknowledged
+            if "cluster_addr_list" in request:
+                self.cluster_addr_list = list(map(lambda addr: Address(addr["ip"], addr["port"]), request["cluster_addr_list"]))
+                self.config_version = request["config_version"]
             self.heartbeat_timer = 0
             follower_resp = self.app_execute(json_request)
 
@@ -490,19 +770,32 @@ class RaftNode:
                 # self.election_term = request["election_term"]
                 # self.voted_for = None
                 # self.cluster_leader_addr = Address(request["cluster_leader_addr"]["ip"], request["cluster_leader_addr"]["port"])
+            elif self.type == RaftNode.NodeType.FOLLOWER and request["election_term"] == self.election_term:
+                # Heartbeats of the current term only come from its leader
+                self.cluster_leader_addr = Address(request["cluster_leader_addr"]["ip"], request["cluster_leader_addr"]["port"])
+                # Lost the election, was deposed, or sync just took over a newer term which ends the
+                # running follower timer, restart it so this node can time out and vote again
+                if was_candidate or was_leader or self.election_term != term_before:
+                    self.__initialize_as_follower()
             response = {
                 "status": "success",
+                "config_version": self.config_version,
             }
+            if self.compressor.enabled:
+                response["compression"] = Compressor.ALGORITHM
             response.update(follower_resp)
 
         # If the term is lower, reject the request
         else:
             response = {
                 "status": "failure",
+                "election_term": self.election_term,
             }
-        self.__print_log(self.__log_repr())
+        if self.verbose:
+            self.__print_log(self.__log_repr())
         return json.dumps(response)
     
+    @profiled("apply_membership")
     def apply_membership(self, json_request: str) -> "json":
         request = json.loads(json_request)
         if (self.type == RaftNode.NodeType.LEADER):
@@ -510,24 +803,22 @@ class RaftNode:
             if new_addr not in self.cluster_addr_list:
                 self.__print_log(f"Add new node {new_addr}")
                 self.cluster_addr_list.append(new_addr)
+                # Versions are [term, counter], leaders of different terms never hand out the same one
+                self.config_version = [self.election_term, self.config_version[1] + 1]
             response = {
                 "status": "success",
                 "cluster_addr_list": self.cluster_addr_list,
+                "config_version": self.config_version,
                 "message_log": self.message_log,
                 "term_log": self.term_log,
                 "election_term": self.election_term,
                 "leader_commit": self.committed_length,
             }
         else:
-            response = {
-                "status": "redirected",
-                "address": {
-                    "ip":   self.cluster_leader_addr.ip,
-                    "port": self.cluster_leader_addr.port,
-                }
-            }
-        return json.dumps(response)
+            response = self.__redirect_response()
+        return self.__encode_response(request, response)
     
+    @profiled("handle_vote_request")
     def handle_vote_request(self, json_request: str) -> "json":
         request = json.loads(json_request)
         candidate_addr = Address(request["candidate_addr"]["ip"], request["candidate_addr"]["port"])
@@ -562,7 +853,8 @@ class RaftNode:
                     "port": self.address.port,
                 }
             }
-            print(f"{bcolors.WARNING} Voted for {candidate_addr} {bcolors.ENDC}")
+            if self.verbose:
+                print(f"{bcolors.WARNING} Voted for {candidate_addr} {bcolors.ENDC}")
         else :
             response = {
             "status": "failure",
@@ -570,6 +862,88 @@ class RaftNode:
         }
         return json.dumps(response)
     
+    def handle_pre_vote_request(self, json_request: str) -> "json":
+        # Same checks as a real vote but nothing is recorded, so a rejected pre-candidate leaves no trace
+        request = json.loads(json_request)
+        last_term = self.term_log[-1] if len(self.term_log) > 0 else 0
+        log_ok = request["last_term"] > last_term or (request["last_term"] == last_term and request["log_length"] >= len(self.message_log))
+        leader_alive = self.type == RaftNode.NodeType.LEADER or (
+            self.type == RaftNode.NodeType.FOLLOWER
+            and self.cluster_leader_addr is not None
+            and self.heartbeat_timer < RaftNode.ELECTION_TIMEOUT_MIN
+        )
+        if request["election_term"] > self.election_term and log_ok and not leader_alive:
+            response = {"status": "success"}
+        else:
+            response = {
+                "status": "failure",
+                "message": "Leader is still alive" if leader_alive else "Candidate is not up to date",
+            }
+        response["address"] = {
+            "ip":   self.address.ip,
+            "port": self.address.port,
+        }
+        return json.dumps(response)
+
+    def timeout_now(self, json_request: str) -> "json":
+        # Sent by the leader handing over leadership, skip the election timeout and pre-vote
+        request = json.loads(json_request)
+        last_term = self.term_log[-1] if len(self.term_log) > 0 else 0
+        if self.type != RaftNode.NodeType.FOLLOWER or request["election_term"] != self.election_term:
+            response = {"status": "failure", "message": "Not a follower of the current term"}
+        elif len(self.message_log) != request["log_length"] or last_term != request["last_term"]:
+            response = {"status": "failure", "message": "Log is not up to date", "log_length": len(self.message_log)}
+        else:
+            self.__print_log("Leadership transfer requested")
+            self.__initialize_as_candidate(skip_pre_vote=True)
+            response = {"status": "success"}
+        return json.dumps(response)
+
+    def transfer_leadership(self, json_request: str) -> "json":
+        request = json.loads(json_request)
+        if self.type != RaftNode.NodeType.LEADER:
+            response = self.__redirect_response()
+            return json.dumps(response)
+
+        target_addr = Address(request["address"]["ip"], request["address"]["port"])
+        if target_addr == self.address:
+            return json.dumps({"status": "success"})
+        if target_addr not in self.cluster_addr_list:
+            return json.dumps({"status": "failure", "message": f"{target_addr} is not a cluster member"})
+
+        # Give the heartbeat loop a few rounds to bring the target up to date
+        response = {"status": "failure", "message": "Target did not catch up"}
+        for _ in range(RaftNode.TRANSFER_ATTEMPTS):
+            timeout_request = {
+                "election_term": self.election_term,
+                "last_term": self.term_log[-1] if len(self.term_log) > 0 else 0,
+                "log_length": len(self.message_log),
+            }
+            response = self.__send_request(timeout_request, "timeout_now", target_addr)
+            if response["status"] == "success" or self.type != RaftNode.NodeType.LEADER:
+                break
+            self.clock.sleep_blocking(RaftNode.HEARTBEAT_INTERVAL)
+        return json.dumps(response)
+
+    def set_profile(self, json_request: str) -> "json":
+        # Safe on a live node, sections are only recorded while enabled
+        request = json.loads(json_request)
+        if request.get("reset", False):
+            self.profiler.reset()
+        if request.get("enabled", True):
+            self.profiler.start(request.get("memory", False), request.get("sample_interval"))
+        else:
+            self.profiler.stop()
+        return json.dumps({"status": "success", "enabled": self.profiler.enabled, "memory": self.profiler.memory})
+
+    def get_profile(self, json_request: str) -> "json":
+        request = json.loads(json_request) or {}
+        response = {"status": "success"}
+        response.update(self.profiler.report())
+        if request.get("reset", False):
+            self.profiler.reset()
+        return json.dumps(response)
+
     def get_node_status(self, json_request: str) -> "json":
         request = json.loads(json_request)
         response = {
@@ -578,22 +952,21 @@ class RaftNode:
             "cluster_leader_addr": {
                 "ip":   self.cluster_leader_addr.ip,
                 "port": self.cluster_leader_addr.port,
-            },
-            "cluster_addr_list": self.cluster_addr_list,
-            "message_log": self.message_log,
-            "term_log": self.term_log,
+            } if self.cluster_leader_addr is not None else None,
+            "cluster_size": len(self.cluster_addr_list),
+            "config_version": self.config_version,
+            "log_length": len(self.message_log),
+            "last_term": self.term_log[-1] if len(self.term_log) > 0 else 0,
             "commit_index": self.commit_index,
-            "leader_commit": self.committed_length,
             "type": self.type.value,
             "voted_for": {
                 "election_term": self.voted_for[0],
-                "candidate_addr": str(self.voted_for)
+                "candidate_addr": str(self.voted_for[1])
             },
-            "commit_index": self.commit_index,
-            "commit_index_log": self.commit_index_log,
+            "uncommitted_length": len(self.commit_index_log),
+            "session_count": len(self.sessions),
+            "compression": self.compressor.report(),
             "committed_length": self.committed_length,
-            "message_log": self.message_log,
-            "term_log": self.term_log,
         }
         return json.dumps(response)
     
@@ -608,44 +981,68 @@ class RaftNode:
     #     return json.dumps(response)
 
     # Client RPCs
-    def request_log(self, _: any):
+    def __log_page(self, request: Dict[str, Any], end: int) -> Dict[str, Any]:
+        start = max(0, min(int(request.get("start", 0)), end))
+        limit = max(0, min(int(request.get("limit", RaftNode.LOG_PAGE_SIZE)), RaftNode.LOG_PAGE_MAX))
+        stop = min(start + limit, end)
+        lines = ["[===]              ~Log~              [===]"]
+        lines.extend(
+            "Term: " + str(self.log.term(i)) + " | Method: " + self.log.message(i)
+            for i in range(start, stop)
+        )
+        return {
+            "status": "success",
+            "log": "\n".join(lines) + "\n",
+            "start": start,
+            "next": stop,
+            "total": end,
+        }
+
+    @profiled("request_log")
+    def request_log(self, json_request: str):
+        request = json.loads(json_request) or {}
         if self.type == RaftNode.NodeType.LEADER:
-            log = "[===]              ~Log~              [===]\n"
-            for i in range(len(self.message_log)):
-                log += "Term: " + str(self.term_log[i]) + " | Method: " + str(self.message_log[i]) + "\n"
-            response = {"status": "success", "log": log}
+            response = self.__log_page(request, len(self.message_log))
         else:
-            response =  {
-                "status": "redirected",
-                "address": {
-                    "ip":   self.cluster_leader_addr.ip,
-                    "port": self.cluster_leader_addr.port,
-                }
-            }
-        return json.dumps(response)
+            response = self.__redirect_response()
+        return self.__encode_response(request, response)
     
+    def tail_log(self, json_request: str):
+        # Only committed entries, poll again from "next" to follow the log
+        request = json.loads(json_request) or {}
+        if self.type == RaftNode.NodeType.LEADER:
+            response = self.__log_page(request, self.committed_length)
+        else:
+            response = self.__redirect_response()
+        return self.__encode_response(request, response)
+
+    @profiled("execute")
     def execute(self, json_request: str) -> "json":
         response = {
             "status": self.AppResponse.FAILURE.value,
         }
         request = json.loads(json_request)
-        if self.type == RaftNode.NodeType.LEADER:
-            # If leader then add first to your own log
-            response = {
-                "status": "success",
-                "ack": False
-            }
-            while response["ack"] == False:
-                response = self.app_execute(json_request)
-                time.sleep(0.05)
-            if request["method"] in ["enqueue", "dequeue"]:
-                self.commit_index_log.append(1)
+        if self.type == RaftNode.NodeType.LEADER and request["method"] == "dequeue" and "timeout" in request:
+            with self.log_lock:
+                response = self.__session_response(request)
+            if response is None:
+                # Park until a message is committed for this consumer or the timeout runs out
+                response = self.__wait_dequeue(float(request["timeout"]), self.__session_prefix(request))
+        elif self.type == RaftNode.NodeType.LEADER:
+            # If leader then add first to your own log. Handlers run on many threads, the session
+            # check, the append and its commit tracking happen as one step under log_lock
+            response = None
+            while response is None:
+                with self.log_lock:
+                    response = self.__session_response(request)
+                    if response is None:
+                        response = self.app_execute(json_request)
+                        if response["ack"] == False:
+                            response = None
+                        elif request["method"] in ["enqueue", "dequeue"]:
+                            self.commit_index_log.append(1)
+                if response is None:
+                    self.clock.sleep_blocking(0.05)
         else:
-            response = {
-                "status": "redirected",
-                "address": {
-                    "ip":   self.cluster_leader_addr.ip,
-                    "port": self.cluster_leader_addr.port,
-                }
-            }
+            response = self.__redirect_response()
         return json.dumps(response)
\ No newline at end of file
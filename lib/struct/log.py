@@ -0,0 +1,166 @@
+from abc import ABC, abstractmethod
+from array import array
+from threading import Lock
+from typing import Any, Dict, Iterator, List
+
+class ColumnarLog:
+    # Terms in one int64 array, payloads utf-8 encoded back to back in one arena,
+    # entry i spans arena[offsets[i]:offsets[i + 1]]. Session prefixes <client_id>:<seq>/
+    # are split off, client ids are interned once and entries keep their index and seq
+    def __init__(self) -> None:
+        self.terms:        array = array("q")
+        self.offsets:      array = array("q", [0])
+        self.clients:      array = array("i")
+        self.seqs:         array = array("q")
+        self.client_ids:   List[str] = []
+        self.client_index: Dict[str, int] = {}
+        self.arena:        bytearray = bytearray()
+        self.lock:         Lock = Lock()
+        self.messages: MessageView = MessageView(self)
+        self.term_view: TermView = TermView(self)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __split_session(self, message: str) -> tuple[int, int, str]:
+        # Caller must hold lock, entries without a session get client -1
+        slash = message.find("/")
+        if slash < 0 or message.find("(", 0, slash) >= 0:
+            return -1, 0, message
+        # Only canonical seqs are split off, anything else is kept verbatim
+        client_id, _, seq = message[:slash].rpartition(":")
+        if client_id == "" or not (seq.isascii() and seq.isdigit()) or (seq[0] == "0" and len(seq) > 1):
+            return -1, 0, message
+        client = self.client_index.get(client_id)
+        if client is None:
+            client = self.client_index[client_id] = len(self.client_ids)
+            self.client_ids.append(client_id)
+        return client, int(seq), message[slash + 1:]
+
+    def append(self, message: str, term: int):
+        with self.lock:
+            client, seq, payload = self.__split_session(message)
+            self.arena += payload.encode()
+            self.offsets.append(len(self.arena))
+            self.clients.append(client)
+            self.seqs.append(seq)
+            self.terms.append(term)
+
+    def extend(self, messages: List[str], terms: List[int]):
+        for i in range(len(messages)):
+            self.append(messages[i], terms[i])
+
+    def truncate(self, length: int):
+        # Drop every entry from index length onwards
+        with self.lock:
+            del self.arena[self.offsets[length]:]
+            del self.offsets[length + 1:]
+            del self.clients[length:]
+            del self.seqs[length:]
+            del self.terms[length:]
+
+    def clear(self):
+        self.truncate(0)
+
+    # Readers take the lock too, handlers on other threads may truncate meanwhile
+    def message(self, index: int) -> str:
+        with self.lock:
+            payload = self.arena[self.offsets[index]:self.offsets[index + 1]].decode()
+            client = self.clients[index]
+            if client < 0:
+                return payload
+            return f"{self.client_ids[client]}:{self.seqs[index]}/{payload}"
+
+    def session(self, index: int) -> tuple[str, int]:
+        # Client id and seq of an entry without decoding it, (None, None) without a session
+        with self.lock:
+            client = self.clients[index]
+            if client < 0:
+                return None, None
+            return self.client_ids[client], self.seqs[index]
+
+    def term(self, index: int) -> int:
+        with self.lock:
+            return self.terms[index]
+
+    def nbytes(self) -> int:
+        columns = [self.offsets, self.clients, self.seqs, self.terms]
+        return len(self.arena) + sum(column.itemsize * len(column) for column in columns) + sum(len(client_id) for client_id in self.client_ids)
+
+
+class _LogView(ABC):
+    # Index range over a ColumnarLog, slicing a view only creates another view.
+    # A view without stop follows the log as it grows
+    def __init__(self, log: ColumnarLog, start: int = 0, stop: int = None) -> None:
+        self.log = log
+        self.start = start
+        self.stop = stop
+
+    def _bounds(self) -> tuple[int, int]:
+        return self.start, len(self.log) if self.stop is None else self.stop
+
+    @abstractmethod
+    def _item(self, index: int) -> Any: ...
+
+    @abstractmethod
+    def tolist(self) -> List[Any]: ...
+
+    def __len__(self) -> int:
+        start, stop = self._bounds()
+        return max(0, stop - start)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError("Log views do not support slice steps")
+            start, stop, _ = key.indices(len(self))
+            return type(self)(self.log, self.start + start, self.start + max(start, stop))
+        length = len(self)
+        if key < 0:
+            key += length
+        if key < 0 or key >= length:
+            raise IndexError("log index out of range")
+        return self._item(self.start + key)
+
+    def __iter__(self) -> Iterator[Any]:
+        start, stop = self._bounds()
+        for index in range(start, stop):
+            yield self._item(index)
+
+    def __repr__(self) -> str:
+        return str(self.tolist())
+
+
+class MessageView(_LogView):
+    def _item(self, index: int) -> str:
+        return self.log.message(index)
+
+    def tolist(self) -> List[str]:
+        start, stop = self._bounds()
+        log = self.log
+        offsets, clients, seqs, client_ids = log.offsets, log.clients, log.seqs, log.client_ids
+        with log.lock:
+            with memoryview(log.arena) as arena:
+                return [
+                    str(arena[offsets[i]:offsets[i + 1]], "utf-8") if clients[i] < 0
+                    else f"{client_ids[clients[i]]}:{seqs[i]}/{str(arena[offsets[i]:offsets[i + 1]], 'utf-8')}"
+                    for i in range(start, stop)
+                ]
+
+
+class TermView(_LogView):
+    def _item(self, index: int) -> int:
+        return self.log.term(index)
+
+    def tolist(self) -> List[int]:
+        start, stop = self._bounds()
+        with self.log.lock:
+            with memoryview(self.log.terms) as terms:
+                return terms[start:stop].tolist()
+
+
+def log_json_default(obj: Any) -> Any:
+    # json.dumps hook, log views are only materialized when a request is serialized
+    if isinstance(obj, _LogView):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,101 @@
+from xmlrpc.client import ServerProxy
+from typing import Any, Dict, List, Set
+from lib.struct.address import Address
+from lib.clock import VirtualClock
+import asyncio
+import socket
+
+class XMLRPCTransport:
+    # Real network, every call goes through a blocking ServerProxy
+    def bind(self, node: Any):
+        # Nodes are exposed by SimpleXMLRPCServer in server.py
+        pass
+
+    def call(self, addr: Address, rpc_name: str, json_request: str) -> str:
+        node = ServerProxy(f"http://{addr.ip}:{addr.port}")
+        rpc_function = getattr(node, rpc_name)
+        return rpc_function(json_request)
+
+    async def async_call(self, addr: Address, rpc_name: str, json_request: str) -> str:
+        # Blocking call in a worker thread so requests to different nodes overlap
+        return await asyncio.to_thread(self.call, addr, rpc_name, json_request)
+
+
+class SimulatedNetwork:
+    # In-memory network shared by every node of a simulated cluster
+    RPC_TIMEOUT = 5
+
+    def __init__(self, clock: VirtualClock, latency: tuple[float, float] = (0.01, 0.05), drop_rate: float = 0.0, rpc_timeout: float = RPC_TIMEOUT) -> None:
+        self.clock:       VirtualClock = clock
+        self.latency:     tuple[float, float] = latency
+        self.drop_rate:   float = drop_rate
+        self.rpc_timeout: float = rpc_timeout
+        self.nodes:       Dict[str, Any] = {}
+        self.partitions:  List[Set[str]] = []
+        self.sent_count:  int = 0
+        self.drop_count:  int = 0
+
+    def register(self, addr: Address, node: Any):
+        self.nodes[str(addr)] = node
+
+    def partition(self, *groups: List[Address]):
+        # Nodes can only reach nodes in the same group, unlisted nodes form their own group
+        self.partitions = [set(map(str, group)) for group in groups]
+
+    def isolate(self, addr: Address):
+        self.partitions.append({str(addr)})
+        for group in self.partitions[:-1]:
+            group.discard(str(addr))
+
+    def heal(self):
+        self.partitions = []
+
+    def __group_of(self, addr: str) -> int:
+        for idx, group in enumerate(self.partitions):
+            if addr in group:
+                return idx
+        return -1
+
+    def __reachable(self, src: str, dst: str) -> bool:
+        return dst in self.nodes and self.__group_of(src) == self.__group_of(dst)
+
+    def deliver(self, src: Address, dst: Address, rpc_name: str, json_request: str) -> str:
+        self.sent_count += 1
+        if not self.__reachable(str(src), str(dst)):
+            raise ConnectionRefusedError(f"{dst} is unreachable from {src}")
+        if self.drop_rate > 0 and self.clock.random.random() < self.drop_rate:
+            self.drop_count += 1
+            raise socket.timeout(f"Request to {dst} dropped")
+        return getattr(self.nodes[str(dst)], rpc_name)(json_request)
+
+    def delay(self) -> float:
+        return self.clock.random.uniform(*self.latency)
+
+
+class SimulatedTransport:
+    def __init__(self, network: SimulatedNetwork) -> None:
+        self.network: SimulatedNetwork = network
+        self.addr:    Address = None
+
+    def bind(self, node: Any):
+        self.addr = node.address
+        self.network.register(node.address, node)
+
+    # A failed call costs the caller the full RPC timeout, like a blocking ServerProxy call would
+    def call(self, addr: Address, rpc_name: str, json_request: str) -> str:
+        try:
+            return self.network.deliver(self.addr, addr, rpc_name, json_request)
+        except (ConnectionRefusedError, socket.timeout):
+            self.network.clock.sleep_blocking(self.network.rpc_timeout)
+            raise
+
+    async def async_call(self, addr: Address, rpc_name: str, json_request: str) -> str:
+        # Request and response each take one network delay
+        await self.network.clock.sleep(self.network.delay())
+        try:
+            response = self.network.deliver(self.addr, addr, rpc_name, json_request)
+        except (ConnectionRefusedError, socket.timeout):
+            await self.network.clock.sleep(self.network.rpc_timeout)
+            raise
+        await self.network.clock.sleep(self.network.delay())
+        return response
@@ -2,30 +2,47 @@ from lib.struct.address       import Address
 from lib.raft          import RaftNode
 from xmlrpc.server import SimpleXMLRPCServer
 from lib.app           import MessageQueue
+from lib.compression   import Compressor
+from socketserver      import ThreadingMixIn
 import sys
 import socket
 
 
-def start_serving(addr: Address, contact_node_addr: Address, passive: bool = False):
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    # Parked long-poll requests must not block heartbeats and votes
+    daemon_threads = True
+
+
+def start_serving(addr: Address, contact_node_addr: Address, passive: bool = False, profile: bool = False, compression_level: int = 0):
     print(f"Starting Raft Server at {addr.ip}:{addr.port}")
-    with SimpleXMLRPCServer((addr.ip, addr.port)) as server:
+    with ThreadedXMLRPCServer((addr.ip, addr.port)) as server:
         server.register_introspection_functions()
-        server.register_instance(RaftNode(MessageQueue(), addr, contact_node_addr, passive))
+        server.register_instance(RaftNode(MessageQueue(), addr, contact_node_addr, passive, profile=profile, compression_level=compression_level))
         server.serve_forever()
 
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("server.py <ip> <port> [<opt: contact ip> <opt: contact port> | <opt: -p>]")
+    profile = "--profile" in sys.argv
+    compression_level = 0
+    for arg in sys.argv:
+        if arg.startswith("--compress="):
+            level = arg.split("=", 1)[1]
+            if not level.isdigit() or not Compressor.LEVEL_MIN <= int(level) <= Compressor.LEVEL_MAX:
+                print(f"--compress expects a zlib level between {Compressor.LEVEL_MIN} and {Compressor.LEVEL_MAX}, got {level}")
+                exit()
+            compression_level = int(level)
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    if len(argv) < 3:
+        print("server.py <ip> <port> [<opt: contact ip> <opt: contact port> | <opt: -p>] [--profile] [--compress=<zlib level 1-9>]")
         exit()
 
     contact_addr = None
-    if len(sys.argv) == 5:
-        contact_addr = Address(sys.argv[3], int(sys.argv[4]))
-    server_addr = Address(sys.argv[1], int(sys.argv[2]))
+    if len(argv) == 5:
+        contact_addr = Address(argv[3], int(argv[4]))
+    server_addr = Address(argv[1], int(argv[2]))
 
-    if len(sys.argv) == 4 and sys.argv[3] == "-p":
-        start_serving(server_addr, contact_addr, True)
+    if len(argv) == 4 and argv[3] == "-p":
+        start_serving(server_addr, contact_addr, True, profile, compression_level)
     else:
-        start_serving(server_addr, contact_addr)
+        start_serving(server_addr, contact_addr, profile=profile, compression_level=compression_level)
@@ -0,0 +1,82 @@
+from lib.struct.address import Address
+from lib.raft          import RaftNode
+from lib.app           import MessageQueue
+from lib.clock         import VirtualClock
+from lib.transport     import SimulatedNetwork, SimulatedTransport
+from typing import Any, Dict, List
+import sys
+import json
+import time
+
+
+class Simulation:
+    def __init__(self, node_count: int, seed: int = 0, latency: tuple[float, float] = (0.01, 0.05), drop_rate: float = 0.0, verbose: bool = False, compression_level: int = 0):
+        self.clock:   VirtualClock = VirtualClock(seed)
+        self.network: SimulatedNetwork = SimulatedNetwork(self.clock, latency, drop_rate, RaftNode.RPC_TIMEOUT)
+        self.addr_list: List[Address] = [Address("sim", 5000 + i) for i in range(node_count)]
+        self.nodes: List[RaftNode] = []
+        for idx, addr in enumerate(self.addr_list):
+            contact_addr = None if idx == 0 else self.addr_list[0]
+            self.nodes.append(RaftNode(MessageQueue(), addr, contact_addr, transport=SimulatedTransport(self.network), clock=self.clock, verbose=verbose, compression_level=compression_level))
+
+    def leader(self) -> RaftNode:
+        # Leader with the highest term, stale leaders may linger inside a partition
+        leaders = [node for node in self.nodes if node.type == RaftNode.NodeType.LEADER]
+        return max(leaders, key=lambda node: node.election_term) if leaders else None
+
+    def execute(self, method: str, params: List[Any] = [], timeout: float = None, session: Dict[str, Any] = None) -> "json":
+        # Clients sit outside the simulated partitions
+        node = self.leader()
+        if node is None:
+            return {"status": "failure"}
+        request = {"method": method, "params": params}
+        if timeout is not None:
+            request["timeout"] = timeout
+        if session is not None:
+            request["session"] = session
+        return json.loads(node.execute(json.dumps(request)))
+
+    def run_for(self, seconds: float):
+        self.clock.run_for(seconds)
+
+    def close(self):
+        self.clock.close()
+
+
+def main(node_count: int, op_count: int, seed: int):
+    wall_start = time.time()
+    sim = Simulation(node_count, seed)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+
+    for i in range(op_count):
+        sim.execute("enqueue", [f"message-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+    leader = sim.leader()
+    print(f"[{sim.clock.time():.1f}s] Leader {leader.address} committed {leader.committed_length}/{len(leader.message_log)} entries")
+
+    # Failover, cut the leader off from the rest of the cluster
+    sim.network.isolate(leader.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    new_leader = sim.leader()
+    print(f"[{sim.clock.time():.1f}s] Leader after isolating {leader.address} : {new_leader.address} (term {new_leader.election_term})")
+
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+    print(f"[{sim.clock.time():.1f}s] Leader after healing : {sim.leader().address} (term {sim.leader().election_term})")
+
+    # Planned handover back to the first node
+    transfer_start = sim.clock.time()
+    response = json.loads(sim.leader().transfer_leadership(json.dumps({"address": leader.address})))
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL)
+    print(f"[{sim.clock.time():.1f}s] Transfer to {leader.address} : {response['status']}, leader {sim.leader().address} after {sim.clock.time() - transfer_start:.1f}s")
+    print(f"[{sim.clock.time():.1f}s] Messages sent: {sim.network.sent_count}, dropped: {sim.network.drop_count}")
+    print(f"Wall time: {time.time() - wall_start:.2f}s")
+    sim.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("simulate.py <node count> <operation count> [<opt: seed>]")
+        exit()
+
+    main(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) == 4 else 0)
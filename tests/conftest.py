@@ -0,0 +1,23 @@
+from typing import Callable, List
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulate import Simulation
+
+
+@pytest.fixture
+def make_sim() -> Callable[..., Simulation]:
+    sims: List[Simulation] = []
+
+    def factory(*args, **kwargs) -> Simulation:
+        sim = Simulation(*args, **kwargs)
+        sims.append(sim)
+        return sim
+
+    yield factory
+    for sim in sims:
+        sim.close()
@@ -0,0 +1,107 @@
+from lib.compression import Compressor
+from lib.raft import RaftNode
+import json
+
+import pytest
+
+
+def test_level_outside_zlib_range_is_refused():
+    with pytest.raises(ValueError):
+        Compressor(12)
+    with pytest.raises(ValueError):
+        Compressor(-1)
+
+
+def test_encode_failure_does_not_stop_the_heartbeat(make_sim):
+    sim = make_sim(3, seed=1, compression_level=6)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    # Bypasses the constructor check, every compressed heartbeat now fails to encode
+    leader.compressor.level = 12
+    for i in range(300):
+        sim.execute("enqueue", [f"message-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert not leader.heartbeat_thread.done()
+    assert leader.type == RaftNode.NodeType.LEADER
+
+
+def payload() -> str:
+    return json.dumps({"messages": [f'enqueue("message number {i}")' for i in range(200)]})
+
+
+def test_round_trip_above_the_threshold_only():
+    compressor = Compressor(6, threshold=1024)
+    small = json.dumps({"messages": ["short"]})
+    assert compressor.encode(small) == small
+
+    text = payload()
+    encoded = compressor.encode(text)
+    assert encoded.startswith(Compressor.PREFIX)
+    assert len(encoded) < len(text)
+    assert compressor.decode(encoded) == text
+    # Plain payloads pass through, and level 0 never compresses
+    assert compressor.decode(text) == text
+    assert Compressor(0).encode(text) == text
+
+
+def test_report_tracks_ratio_and_cpu():
+    compressor = Compressor(6)
+    text = payload()
+    encoded = compressor.encode(text)
+    compressor.decode(encoded)
+    report = compressor.report()
+    assert (report["compressed_count"], report["decompressed_count"]) == (1, 1)
+    assert (report["raw_bytes"], report["compressed_bytes"]) == (len(text), len(encoded))
+    assert report["ratio"] == pytest.approx(len(text) / len(encoded))
+    assert report["ratio"] > 1
+    assert report["compress_cpu"] >= 0 and report["decompress_cpu"] >= 0
+    assert (report["level"], report["threshold"]) == (6, Compressor.THRESHOLD)
+    assert Compressor(6).report()["ratio"] == 1.0
+
+
+def test_leader_compresses_only_for_followers_that_advertise_zlib(make_sim):
+    sim = make_sim(3, seed=1, compression_level=6)
+    leader, advertising, plain = sim.nodes
+    # Turned off after joining, its next heartbeat answer no longer advertises zlib
+    plain.compressor.level = 0
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert leader.follower_compression.get(str(advertising.address)) is True
+    assert leader.follower_compression.get(str(plain.address), False) is False
+
+    received = {str(advertising.address): [], str(plain.address): []}
+    for node in (advertising, plain):
+        def spy(json_request: str, node=node, heartbeat=node.heartbeat) -> str:
+            received[str(node.address)].append(json_request.startswith(Compressor.PREFIX))
+            return heartbeat(json_request)
+        node.heartbeat = spy
+    for i in range(300):
+        sim.execute("enqueue", [f"message-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+
+    assert any(received[str(advertising.address)])
+    assert not any(received[str(plain.address)])
+    assert advertising.app.queue == plain.app.queue == leader.app.queue
+    assert leader.compressor.report()["compressed_count"] > 0
+
+
+def test_log_and_membership_responses_are_compressed_on_request(make_sim):
+    sim = make_sim(3, seed=1, compression_level=6)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    for i in range(300):
+        sim.execute("enqueue", [f"message-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+
+    plain = leader.request_log(json.dumps({"limit": 300}))
+    compressed = leader.request_log(json.dumps({"limit": 300, "compression": Compressor.ALGORITHM}))
+    assert not plain.startswith(Compressor.PREFIX)
+    assert compressed.startswith(Compressor.PREFIX)
+    assert json.loads(leader.compressor.decode(compressed)) == json.loads(plain)
+
+    member = sim.nodes[1].address
+    request = {"address": {"ip": member.ip, "port": member.port}, "compression": Compressor.ALGORITHM}
+    response = leader.apply_membership(json.dumps(request))
+    assert response.startswith(Compressor.PREFIX)
+    response = json.loads(leader.compressor.decode(response))
+    assert response["status"] == "success" and len(response["message_log"]) == 300
+    assert len(leader.cluster_addr_list) == 3
@@ -0,0 +1,56 @@
+from lib.struct.log import ColumnarLog, _LogView, log_json_default
+import json
+
+import pytest
+
+MESSAGES = [
+    'client-a:1/enqueue("hello")',
+    "dequeue()",
+    'enqueue("a/b")',
+    "client:b:7/dequeue()",
+    'client-c:01/enqueue("kept verbatim")',
+    'client-a:2/enqueue("ünïcode")',
+]
+
+
+@pytest.fixture
+def log() -> ColumnarLog:
+    log = ColumnarLog()
+    log.extend(MESSAGES, list(range(len(MESSAGES))))
+    return log
+
+
+def test_entries_round_trip(log):
+    assert [log.message(i) for i in range(len(log))] == MESSAGES
+    assert log.messages.tolist() == MESSAGES
+    assert log.term_view.tolist() == list(range(len(MESSAGES)))
+
+
+def test_session_prefix_is_stored_once_per_client(log):
+    assert log.session(0) == ("client-a", 1)
+    assert log.session(1) == (None, None)
+    assert log.session(3) == ("client:b", 7)
+    assert log.session(4) == (None, None)
+    assert log.client_ids == ["client-a", "client:b"]
+    assert b"client-a" not in log.arena
+
+
+def test_slices_are_views(log):
+    tail = log.messages[2:]
+    assert json.loads(json.dumps(tail, default=log_json_default)) == MESSAGES[2:]
+    assert tail[-1] == MESSAGES[-1]
+    with pytest.raises(IndexError):
+        tail[len(MESSAGES)]
+
+
+def test_truncate_drops_every_column(log):
+    log.truncate(2)
+    log.append("client-d:3/dequeue()", 9)
+    assert log.messages.tolist() == MESSAGES[:2] + ["client-d:3/dequeue()"]
+    assert log.term_view.tolist() == [0, 1, 9]
+    assert len(log.clients) == len(log.seqs) == len(log.offsets) - 1 == 3
+
+
+def test_base_view_is_abstract(log):
+    with pytest.raises(TypeError):
+        _LogView(log)
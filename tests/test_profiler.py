@@ -0,0 +1,23 @@
+from lib.profiler import Profiler
+import tracemalloc
+
+
+def test_turning_memory_off_stops_its_own_trace():
+    profiler = Profiler()
+    profiler.start(memory=True, sample_interval=0)
+    assert tracemalloc.is_tracing()
+    profiler.start(memory=False, sample_interval=0)
+    assert not tracemalloc.is_tracing()
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_foreign_trace_is_left_running():
+    tracemalloc.start()
+    try:
+        profiler = Profiler()
+        profiler.start(memory=True, sample_interval=0)
+        profiler.stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
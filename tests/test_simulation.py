@@ -0,0 +1,430 @@
+from lib.raft import RaftNode
+from lib.struct.address import Address
+from threading import Thread
+import json
+import time
+
+import pytest
+
+
+def run_scenario(sim) -> tuple:
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    for i in range(20):
+        sim.execute("enqueue", [f"message-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+    sim.network.isolate(sim.leader().address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    leader = sim.leader()
+    return str(leader.address), leader.election_term, sim.network.sent_count, sim.clock.time()
+
+
+def test_first_node_leads_whole_cluster(make_sim):
+    sim = make_sim(5, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert sim.leader() is sim.nodes[0]
+    for node in sim.nodes:
+        assert len(node.cluster_addr_list) == 5
+        assert node.cluster_leader_addr == sim.nodes[0].address
+
+
+def test_enqueues_commit_on_every_node(make_sim):
+    sim = make_sim(5, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    for i in range(50):
+        assert sim.execute("enqueue", [f"message-{i}"])["ack"] is True
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+    for node in sim.nodes:
+        assert node.committed_length == 50
+        assert node.app.queue == [f"message-{i}" for i in range(50)]
+
+
+def test_failover_when_leader_is_partitioned(make_sim):
+    sim = make_sim(5, seed=2)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    old_leader = sim.leader()
+    sim.network.isolate(old_leader.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+
+    new_leader = sim.leader()
+    assert new_leader is not old_leader
+    assert new_leader.election_term > old_leader.election_term
+
+    # The remaining majority keeps committing, rounds now also wait out the timeout to the lost node
+    sim.execute("enqueue", ["after-failover"])
+    sim.run_for((RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT) * 3)
+    followers = [node for node in sim.nodes if node is not old_leader]
+    assert all(node.app.queue == ["after-failover"] for node in followers)
+    assert old_leader.app.queue == []
+
+
+def test_same_seed_reproduces_the_run(make_sim):
+    assert run_scenario(make_sim(7, seed=11)) == run_scenario(make_sim(7, seed=11))
+
+
+def test_unreachable_call_costs_rpc_timeout(make_sim):
+    sim = make_sim(2, seed=1)
+    target = sim.nodes[1]
+    sim.network.isolate(target.address)
+    transport = sim.nodes[0].transport
+    start = sim.clock.time()
+    with pytest.raises(ConnectionRefusedError):
+        transport.call(target.address, "get_node_status", "{}")
+    assert sim.clock.time() - start == pytest.approx(RaftNode.RPC_TIMEOUT)
+
+
+def test_node_status_reports_commit_once(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.execute("enqueue", ["status"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    status = json.loads(sim.leader().get_node_status("{}"))
+    assert status["committed_length"] == 1
+    assert "leader_commit" not in status
+
+
+def test_claimed_dequeue_survives_a_stalled_commit(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.execute("enqueue", ["hello"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    for node in sim.nodes:
+        if node is not leader:
+            sim.network.isolate(node.address)
+
+    # The dequeue claims "hello" but cannot commit while the followers are cut off
+    session = {"client_id": "consumer", "seq": 1}
+    assert sim.execute("dequeue", timeout=1, session=session) == {"status": "pending", "ack": True}
+    assert sim.execute("dequeue", timeout=1, session=session) == {"status": "pending", "ack": True}
+
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+    response = sim.execute("dequeue", timeout=1, session=session)
+    assert response["status"] == "success" and response["result"] == "hello"
+    assert all(node.app.queue == [] for node in sim.nodes)
+
+
+def test_overtaken_sequence_number_is_applied(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert sim.execute("enqueue", ["second"], session={"client_id": "c", "seq": 2})["ack"] is True
+    assert sim.execute("enqueue", ["first"], session={"client_id": "c", "seq": 1})["ack"] is True
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert sim.execute("enqueue", ["third"], session={"client_id": "c", "seq": 3})["ack"] is True
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert all(node.app.queue == ["second", "first", "third"] for node in sim.nodes)
+
+    # Retrying an applied seq is still answered as a duplicate
+    assert sim.execute("enqueue", ["first"], session={"client_id": "c", "seq": 1})["duplicate"] is True
+
+
+def test_sequence_number_behind_the_window_is_rejected(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    last_seq = RaftNode.SESSION_WINDOW + 5
+    assert sim.execute("enqueue", ["latest"], session={"client_id": "c", "seq": last_seq})["ack"] is True
+    response = sim.execute("enqueue", ["too-late"], session={"client_id": "c", "seq": 5})
+    assert response == {"status": "rejected", "ack": False, "last_seq": last_seq}
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert all(node.app.queue == ["latest"] for node in sim.nodes)
+
+
+def test_follower_applies_attached_membership(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    assert leader.config_version == [leader.election_term, 2]
+
+    # A stale list under the same version is still replaced once the leader attaches its own
+    follower = sim.nodes[1]
+    follower.cluster_addr_list = follower.cluster_addr_list[:1]
+    leader.follower_config_versions.clear()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert follower.cluster_addr_list == leader.cluster_addr_list
+
+
+def test_deposed_leader_can_take_part_in_the_next_election(make_sim):
+    sim = make_sim(3, seed=3)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    old_leader = sim.leader()
+    sim.network.isolate(old_leader.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 4)
+
+    new_leader = sim.leader()
+    assert new_leader is not old_leader
+    assert old_leader.type == RaftNode.NodeType.FOLLOWER
+    assert old_leader.cluster_leader_addr == new_leader.address
+
+    # Losing the new leader leaves the deposed one and the last follower to elect among themselves
+    sim.network.isolate(new_leader.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    leaders = [node for node in sim.nodes if node is not new_leader and node.type == RaftNode.NodeType.LEADER]
+    assert len(leaders) == 1
+    assert leaders[0].election_term > new_leader.election_term
+
+
+def test_ack_false_without_addr_keeps_the_leader_running(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    # Shape of the sync answer when the follower hit an exception, it carries no addr
+    follower = sim.nodes[1]
+    follower.app_execute = lambda json_request: {"status": "success", "ack": False, "message_len": 0, "last_message": "", "last_term": 0}
+    sim.execute("enqueue", ["still-committing"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 3)
+    assert not leader.heartbeat_thread.done()
+    assert str(follower.address) in leader.troubled_clusters
+    assert leader.app.queue == ["still-committing"]
+
+
+def page_entries(response: dict) -> list:
+    # Drop the header line and the trailing newline
+    return response["log"].split("\n")[1:-1]
+
+
+def test_request_log_pages_are_clamped(make_sim, monkeypatch):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    for i in range(12):
+        sim.execute("enqueue", [f"m{i}"])
+    leader = sim.leader()
+
+    response = json.loads(leader.request_log(json.dumps({"start": 2, "limit": 3})))
+    assert (response["start"], response["next"], response["total"]) == (2, 5, 12)
+    assert page_entries(response) == [f'Term: 0 | Method: enqueue("m{i}")' for i in range(2, 5)]
+
+    response = json.loads(leader.request_log(json.dumps({"start": -5, "limit": -1})))
+    assert (response["start"], response["next"]) == (0, 0)
+    response = json.loads(leader.request_log(json.dumps({"start": 50})))
+    assert (response["start"], response["next"], page_entries(response)) == (12, 12, [])
+
+    monkeypatch.setattr(RaftNode, "LOG_PAGE_MAX", 4)
+    response = json.loads(leader.request_log(json.dumps({"start": 0, "limit": 100})))
+    assert response["next"] == 4 and len(page_entries(response)) == 4
+
+
+def test_tail_log_serves_committed_entries_only(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.execute("enqueue", ["committed"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.execute("enqueue", ["pending"])
+    leader = sim.leader()
+
+    response = json.loads(leader.tail_log(json.dumps({"start": 0})))
+    assert (response["next"], response["total"]) == (1, 1)
+    assert page_entries(response) == ['Term: 0 | Method: enqueue("committed")']
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    response = json.loads(leader.tail_log(json.dumps({"start": response["next"]})))
+    assert page_entries(response) == ['Term: 0 | Method: enqueue("pending")']
+
+
+def test_log_rpcs_accept_a_null_body(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.execute("enqueue", ["only"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    for rpc in (leader.request_log, leader.tail_log):
+        response = json.loads(rpc("null"))
+        assert (response["status"], response["start"], response["total"]) == ("success", 0, 1)
+
+
+def test_concurrent_executes_each_get_their_own_entry(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+
+    def enqueue_many(worker: int):
+        for i in range(200):
+            request = {"method": "enqueue", "params": [f"{worker}-{i}"], "session": {"client_id": f"w{worker}", "seq": i + 1}}
+            assert json.loads(leader.execute(json.dumps(request)))["ack"] is True
+
+    # Handlers run on server threads, widen the gap between reading the log length and appending there
+    view_len = type(leader.message_log).__len__
+    def slow_len() -> int:
+        length = view_len(leader.message_log)
+        time.sleep(0.0001)
+        return length
+    leader.message_log.__len__ = slow_len
+
+    threads = [Thread(target=enqueue_many, args=[worker]) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(leader.log) == len(leader.commit_index_log) == 800
+    assert len(set(leader.message_log.tolist())) == 800
+
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    expected = sorted(f"{worker}-{i}" for worker in range(4) for i in range(200))
+    assert all(sorted(node.app.queue) == expected for node in sim.nodes)
+
+
+def test_follower_that_missed_a_transfer_still_votes(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    node_a, node_b, node_c = sim.nodes
+    sim.network.isolate(node_c.address)
+    assert json.loads(node_a.transfer_leadership(json.dumps({"address": {"ip": node_b.address.ip, "port": node_b.address.port}})))["status"] == "success"
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    assert sim.leader() is node_b
+
+    # C takes over the newer term from B's heartbeat and must keep its election timer running
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT * 2)
+    assert node_c.election_term == node_b.election_term
+    assert node_c.cluster_leader_addr == node_b.address
+    sim.network.isolate(node_b.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    leaders = [node for node in (node_a, node_c) if node.type == RaftNode.NodeType.LEADER]
+    assert len(leaders) == 1
+
+
+@pytest.mark.parametrize("seed", [6, 9, 11, 23])
+def test_stepped_down_leader_redirects_to_the_new_one(make_sim, seed):
+    sim = make_sim(3, seed=seed)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    old_leader = sim.leader()
+    sim.network.isolate(old_leader.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+    new_leader = sim.leader()
+    sim.network.heal()
+
+    # Whichever comes first, its own rejected heartbeat or the new leader's sync,
+    # clients are answered all the way through
+    for _ in range(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT * 2):
+        sim.run_for(1)
+        response = json.loads(old_leader.execute(json.dumps({"method": "dequeue"})))
+        assert response["status"] in ("success", "redirected")
+    assert old_leader.type == RaftNode.NodeType.FOLLOWER
+    assert old_leader.cluster_leader_addr == new_leader.address
+    response = json.loads(old_leader.execute(json.dumps({"method": "enqueue", "params": ["x"]})))
+    assert response["status"] == "redirected" and Address(**response["address"]) == new_leader.address
+
+
+def test_rejoining_node_cannot_disrupt_the_leader(make_sim):
+    sim = make_sim(5, seed=4)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader = sim.leader()
+    straggler = sim.nodes[3]
+    sim.network.isolate(straggler.address)
+    sim.run_for(RaftNode.ELECTION_TIMEOUT_MAX * 3)
+
+    # Its pre-votes failed while cut off, so it never bumped its term
+    assert straggler.type != RaftNode.NodeType.LEADER
+    assert straggler.election_term == leader.election_term
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT * 2)
+    assert sim.leader() is leader
+    assert all(node.election_term == leader.election_term for node in sim.nodes)
+
+
+def test_pre_vote_is_refused_while_the_leader_is_alive(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    follower = sim.nodes[1]
+    request = {"election_term": follower.election_term + 1, "last_term": 0, "log_length": len(follower.log), "candidate_addr": {"ip": "sim", "port": 5002}}
+    response = json.loads(follower.handle_pre_vote_request(json.dumps(request)))
+    assert response["status"] == "failure" and response["message"] == "Leader is still alive"
+    # Nothing is recorded for a pre-vote
+    assert follower.voted_for[0] == 0
+
+
+def address_request(node) -> str:
+    return json.dumps({"address": {"ip": node.address.ip, "port": node.address.port}})
+
+
+def test_election_returns_on_quorum_without_waiting_for_unreachable_nodes(make_sim):
+    sim = make_sim(5, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    node_a, node_b = sim.nodes[0], sim.nodes[1]
+    sim.network.isolate(sim.nodes[3].address)
+    sim.network.isolate(sim.nodes[4].address)
+
+    assert json.loads(node_a.transfer_leadership(address_request(node_b)))["status"] == "success"
+    # Two of the five vote requests only fail after RPC_TIMEOUT, the other three already make a majority
+    sim.run_for(RaftNode.RPC_TIMEOUT / 2)
+    assert node_b.type == RaftNode.NodeType.LEADER
+    assert node_a.type == RaftNode.NodeType.FOLLOWER
+
+
+def test_timeout_now_checks_term_and_log(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    follower = sim.nodes[1]
+    request = {"election_term": follower.election_term, "last_term": 0, "log_length": len(follower.log)}
+
+    stale = dict(request, election_term=follower.election_term + 1)
+    assert json.loads(follower.timeout_now(json.dumps(stale)))["message"] == "Not a follower of the current term"
+    behind = dict(request, log_length=len(follower.log) + 1)
+    assert json.loads(follower.timeout_now(json.dumps(behind)))["message"] == "Log is not up to date"
+    assert json.loads(sim.leader().timeout_now(json.dumps(request)))["status"] == "failure"
+
+    assert json.loads(follower.timeout_now(json.dumps(request)))["status"] == "success"
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL)
+    assert sim.leader() is follower
+
+
+def test_transfer_leadership_rejects_non_members(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    response = json.loads(sim.leader().transfer_leadership(json.dumps({"address": {"ip": "sim", "port": 6000}})))
+    assert response["status"] == "failure" and "not a cluster member" in response["message"]
+    assert json.loads(sim.leader().transfer_leadership(address_request(sim.leader())))["status"] == "success"
+    # Followers point the caller at the leader
+    response = json.loads(sim.nodes[1].transfer_leadership(address_request(sim.nodes[2])))
+    assert response["status"] == "redirected" and Address(**response["address"]) == sim.leader().address
+
+
+def test_transfer_leadership_waits_for_the_target_to_catch_up(make_sim, monkeypatch):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    leader, target = sim.nodes[0], sim.nodes[2]
+    sim.network.isolate(target.address)
+    for i in range(3):
+        sim.execute("enqueue", [f"m{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT)
+    sim.network.heal()
+
+    # A single attempt finds the target behind
+    monkeypatch.setattr(RaftNode, "TRANSFER_ATTEMPTS", 1)
+    response = json.loads(leader.transfer_leadership(address_request(target)))
+    assert response["status"] == "failure" and response["message"] == "Log is not up to date"
+    assert sim.leader() is leader
+
+    # With more rounds the heartbeat brings it up to date first
+    monkeypatch.setattr(RaftNode, "TRANSFER_ATTEMPTS", 5)
+    assert json.loads(leader.transfer_leadership(address_request(target)))["status"] == "success"
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL)
+    assert sim.leader() is target
+    assert target.app.queue == ["m0", "m1", "m2"]
+
+
+def test_lagging_follower_only_receives_the_missing_suffix(make_sim):
+    sim = make_sim(3, seed=1)
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    lagging = sim.nodes[2]
+    for i in range(5):
+        sim.execute("enqueue", [f"before-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL * 2)
+    sim.network.isolate(lagging.address)
+    for i in range(5):
+        sim.execute("enqueue", [f"after-{i}"])
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT)
+
+    received = []
+    heartbeat = lagging.heartbeat
+    def spy(json_request: str) -> str:
+        request = json.loads(json_request)
+        received.append((request["prefix_len"], len(request.get("messages", []))))
+        return heartbeat(json_request)
+    lagging.heartbeat = spy
+    sim.network.heal()
+    sim.run_for(RaftNode.HEARTBEAT_INTERVAL + RaftNode.RPC_TIMEOUT * 2)
+
+    assert (5, 5) in received
+    assert all(prefix_len > 0 for prefix_len, _ in received)
+    assert lagging.app.queue == [f"before-{i}" for i in range(5)] + [f"after-{i}" for i in range(5)]